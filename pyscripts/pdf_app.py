@@ -2,9 +2,44 @@ import streamlit as st
 import tempfile
 import os
 import base64
+import contextlib
+import functools
+import hashlib
+import math
+import mimetypes
+import shutil
+import threading
+import time
 import uuid
-import fitz  # PyMuPDF
-from pdf_tool import process_pdf, merge_pdfs, extract_images_from_pdf, encrypt_pdf, decrypt_pdf
+import zipfile
+from pdf_tool import PageCache, IMAGE_INDEX_FILENAME, THUMBNAIL_DPI, THUMBNAIL_INDEX_FILENAME, inspect_pdf
+from pdf_encoding import DEFAULT_PRESET, ENCODING_PRESETS
+from pdf_page_ranges import format_page_ranges
+from pdf_jobs import ACTIVE_STATES, JobManager
+
+PAGE_CACHE_DIR = os.environ.get("PDF_TOOL_CACHE_DIR", os.path.join(tempfile.gettempdir(), "pdf_tool_cache"))
+# 每个会话的输出文件写入磁盘上的独立目录，session_state 中只保存文件名
+SESSION_SPOOL_DIR = os.environ.get("PDF_APP_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "pdf_app_sessions"))
+SESSION_TTL = int(os.environ.get("PDF_APP_SESSION_TTL", 3600))
+SESSION_SWEEP_INTERVAL = 300
+# 后台任务进程数，所有会话共用
+JOB_WORKERS = int(os.environ.get("PDF_APP_JOB_WORKERS", os.cpu_count() or 1))
+JOB_POLL_INTERVAL = 1
+JOB_CANCEL_TIMEOUT = 10  # 提交新任务前等待上一个任务停止的最长秒数
+# 按内容哈希缓存的上传文件信息条数
+PDF_INFO_CACHE_ENTRIES = 64
+# 未加密文档的缩略图按内容哈希保存在共享目录中，超过 THUMBNAIL_CACHE_TTL 秒未使用则删除
+THUMBNAIL_CACHE_DIR = os.environ.get("PDF_APP_THUMBNAIL_DIR", os.path.join(tempfile.gettempdir(), "pdf_app_thumbnails"))
+THUMBNAIL_CACHE_TTL = 7 * 24 * 3600
+# 页面选择器每屏显示的缩略图数量和列数
+PICKER_PAGE_SIZE = 48
+PICKER_COLUMNS = 6
+
+
+@st.cache_resource
+def get_page_cache():
+    # 所有会话共用同一个页面位图缓存
+    return PageCache(PAGE_CACHE_DIR)
 
 
 def get_binary_file_downloader_html(bin_file, file_label='File'):
@@ -15,159 +50,400 @@ def get_binary_file_downloader_html(bin_file, file_label='File'):
     return href
 
 
-def check_pdf_encryption(file_content):
-    with fitz.open(stream=file_content, filetype="pdf") as doc:
-        return doc.is_encrypted
+@st.cache_data(max_entries=PDF_INFO_CACHE_ENTRIES, show_spinner="正在读取 PDF 信息...")
+def get_pdf_info(content_hash, _file_content):
+    # 以内容哈希为键，文件内容本身不参与缓存键的计算
+    return inspect_pdf(_file_content)
+
+
+def get_upload_hash(uploaded_file):
+    # 同一次上传只计算一次内容哈希
+    upload_hashes = st.session_state.setdefault('upload_hashes', {})
+    if uploaded_file.file_id not in upload_hashes:
+        upload_hashes[uploaded_file.file_id] = hashlib.sha256(uploaded_file.getbuffer()).hexdigest()
+    return upload_hashes[uploaded_file.file_id]
+
+
+def get_upload_info(uploaded_file):
+    """返回上传文件的加密标记、页数、页面尺寸、图片数量和缩略图，同一上传只解析一次"""
+    return get_pdf_info(get_upload_hash(uploaded_file), uploaded_file.getbuffer())
+
+
+def show_pdf_info(info):
+    if info['image_count'] is None:
+        st.caption(f"共 {info['page_count']} 页")
+        return
+    width, height = info['page_sizes'][0]
+    st.caption(f"共 {info['page_count']} 页，首页尺寸 {width:.0f} × {height:.0f} 点，"
+               f"{info['image_count']} 张不重复的嵌入图片")
+    st.image(info['thumbnails'], caption=[f"第 {i + 1} 页" for i in range(len(info['thumbnails']))], width=120)
+
+
+def get_session_spool_root():
+    """返回本会话的输出目录，并刷新其修改时间，过期清理以此判断会话是否仍在使用"""
+    if 'spool_id' not in st.session_state:
+        st.session_state.spool_id = uuid.uuid4().hex
+    session_dir = os.path.join(SESSION_SPOOL_DIR, st.session_state.spool_id)
+    os.makedirs(session_dir, exist_ok=True)
+    os.utime(session_dir)
+    return session_dir
+
+
+def reset_session_spool(area):
+    """清空本会话某个功能的输出目录（及其 ZIP 包），返回该目录"""
+    session_dir = get_session_spool_root()
+    area_dir = os.path.join(session_dir, area)
+    shutil.rmtree(area_dir, ignore_errors=True)
+    zip_path = os.path.join(session_dir, f"{area}.zip")
+    if os.path.exists(zip_path):
+        os.remove(zip_path)
+    os.makedirs(area_dir)
+    return area_dir
+
+
+def sweep_expired_sessions(ttl=SESSION_TTL, spool_dir=SESSION_SPOOL_DIR):
+    """删除 spool_dir 下超过 ttl 秒未访问的目录"""
+    if not os.path.isdir(spool_dir):
+        return
+    now = time.time()
+    for name in os.listdir(spool_dir):
+        path = os.path.join(spool_dir, name)
+        try:
+            if now - os.path.getmtime(path) > ttl:
+                shutil.rmtree(path, ignore_errors=True)
+        except FileNotFoundError:
+            pass
+
+
+@st.cache_resource
+def start_session_sweeper():
+    # 每个服务进程只启动一个后台清理线程
+    manager = get_job_manager()
+
+    def sweep_forever():
+        while True:
+            sweep_expired_sessions()
+            sweep_expired_sessions(THUMBNAIL_CACHE_TTL, THUMBNAIL_CACHE_DIR)
+            manager.sweep(SESSION_TTL)
+            time.sleep(SESSION_SWEEP_INTERVAL)
+
+    thread = threading.Thread(target=sweep_forever, name="pdf-app-session-sweeper", daemon=True)
+    thread.start()
+    return thread
+
+
+def build_zip(file_paths, zip_path):
+    """逐个文件从磁盘写入 ZIP，图片已经压缩过，只做存储不再压缩"""
+    tmp_path = f"{zip_path}.tmp"
+    with zipfile.ZipFile(tmp_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for path in file_paths:
+            zf.write(path, os.path.basename(path))
+    os.replace(tmp_path, zip_path)
+
+
+def read_spooled_file(path):
+    """读取落盘的输出文件。Streamlit 会把返回的内容整体放入内存后再提供下载。"""
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def show_spooled_downloads(area, file_names, title):
+    """单个文件直接提供下载，多个文件在用户点击后才打包成一个 ZIP。
+
+    下载按钮传入读取函数，只是把读取推迟到用户点击下载时，每次重新运行页面不会重复载入；
+    Streamlit 仍会把整个文件（包括 ZIP）读入内存后再发送，点击时的内存峰值与文件大小相当。
+    """
+    session_dir = get_session_spool_root()
+    area_dir = os.path.join(session_dir, area)
+    file_paths = [os.path.join(area_dir, name) for name in file_names]
+    if not all(os.path.exists(path) for path in file_paths):
+        st.info("输出文件已过期清理，请重新处理。")
+        return
+
+    total_bytes = sum(os.path.getsize(path) for path in file_paths)
+    st.write(f"{title}: 共 {len(file_paths)} 个文件, {total_bytes / 1024 ** 2:.1f} MB")
+    if len(file_paths) == 1:
+        mime = mimetypes.guess_type(file_paths[0])[0] or "application/octet-stream"
+        st.download_button(label=f"下载 {file_names[0]}", data=functools.partial(read_spooled_file, file_paths[0]),
+                           file_name=file_names[0], mime=mime, key=f"{area}_download")
+        return
+
+    zip_path = os.path.join(session_dir, f"{area}.zip")
+    if not os.path.exists(zip_path):
+        if not st.button("打包为 ZIP", key=f"{area}_zip"):
+            return
+        with st.spinner("正在打包..."):
+            build_zip(file_paths, zip_path)
+    st.download_button(label=f"下载 ZIP ({os.path.getsize(zip_path) / 1024 ** 2:.1f} MB)",
+                       data=functools.partial(read_spooled_file, zip_path), file_name=f"{area}.zip",
+                       mime="application/zip", key=f"{area}_zip_download")
+
+
+@st.cache_resource
+def get_job_manager():
+    # 所有会话共用一个进程池，按会话轮流调度
+    return JobManager(JOB_WORKERS)
+
+
+def save_uploads(area, uploaded_files):
+    """把上传的文件写入本会话的输入目录，工作进程通过路径读取"""
+    upload_dir = reset_session_spool(f"{area}_inputs")
+    paths = []
+    for i, uploaded_file in enumerate(uploaded_files):
+        path = os.path.join(upload_dir, f"{i:04d}.pdf")
+        with open(path, 'wb') as f:
+            f.write(uploaded_file.getbuffer())
+        paths.append(path)
+    return paths
+
+
+def save_thumbnail_input(uploaded_file, content_hash):
+    """缩略图任务的输入按内容哈希命名，写入后不再改动，运行中的任务不会读到之后上传的文件"""
+    input_dir = os.path.join(get_session_spool_root(), "thumbnails_inputs")
+    os.makedirs(input_dir, exist_ok=True)
+    path = os.path.join(input_dir, f"{content_hash}.pdf")
+    if not os.path.exists(path):
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(uploaded_file.getbuffer())
+        os.replace(tmp_path, path)
+    return path
+
+
+def remove_stale_thumbnail_inputs(keep_path):
+    input_dir = os.path.dirname(keep_path)
+    for name in os.listdir(input_dir):
+        if name != os.path.basename(keep_path):
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(input_dir, name))
+
+
+def cancel_job(area, timeout=JOB_CANCEL_TIMEOUT):
+    """取消某个功能仍在进行的任务并等待它停止，返回任务是否已停止"""
+    job = get_job(area)
+    if job is None or job['state'] not in ACTIVE_STATES:
+        return True
+    get_job_manager().cancel(job['id'])
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if get_job(area)['state'] not in ACTIVE_STATES:
+            return True
+        time.sleep(0.1)
+    return False
+
+
+def submit_job(area, kind, *args, **kwargs):
+    manager = get_job_manager()
+    jobs = st.session_state.setdefault('jobs', {})
+    if area in jobs:
+        manager.forget(jobs[area])
+    jobs[area] = manager.submit(st.session_state.spool_id, kind, *args, **kwargs)
+
+
+def get_job(area):
+    job_id = st.session_state.get('jobs', {}).get(area)
+    return get_job_manager().status(job_id) if job_id else None
+
+
+def job_active(area):
+    job = get_job(area)
+    return job is not None and job['state'] in ACTIVE_STATES
+
+
+def clear_job(area):
+    """丢弃某个功能已结束的任务及其输出，任务仍在运行时不做处理"""
+    if job_active(area):
+        return
+    job_id = st.session_state.get('jobs', {}).pop(area, None)
+    if job_id:
+        get_job_manager().forget(job_id)
+        reset_session_spool(area)
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+def show_job_progress(area):
+    # 只刷新进度区域，任务结束后整页重新运行以显示结果
+    job = get_job(area)
+    if job is None or job['state'] not in ACTIVE_STATES:
+        st.rerun()
+    get_session_spool_root()
+
+    if job['state'] == 'queued':
+        st.info(f"排队中，前面还有 {job['queue_position'] - 1} 个任务...")
+    elif job['state'] == 'cancelling':
+        st.info("正在取消...")
+    elif job['total']:
+        st.progress(job['done'] / job['total'], text=f"进度: {job['done']}/{job['total']}")
+    else:
+        st.progress(0.0, text="处理中...")
+
+    if job['state'] != 'cancelling' and st.button("取消", key=f"{area}_cancel"):
+        get_job_manager().cancel(job['id'])
+
+
+def show_job_result(area, title, output_filter=None):
+    """显示某个功能最近一次任务的进度或结果"""
+    job = get_job(area)
+    if job is None:
+        return
+    if job['state'] in ACTIVE_STATES:
+        show_job_progress(area)
+        return
+    if job['state'] == 'failed':
+        st.error(f"处理过程中出错: {job['error']}")
+        return
+    if job['state'] == 'cancelled':
+        st.info("任务已取消。")
+        return
+
+    st.success(f"处理完成！耗时 {job['finished'] - job['started']:.1f} 秒")
+    if 'cache' in job['info']:
+        stats = job['info']['cache']
+        st.caption(f"页面缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, 淘汰 {stats['evictions']} 个")
+    if 'encode' in job['info']:
+        summary = job['info']['encode']
+        st.caption(f"图片编码 ({summary['preset']}): 平均 {summary['ms_per_image']:.1f} 毫秒/张, "
+                   f"平均 {summary['bytes_per_image'] / 1024:.1f} KB/张")
+
+    area_dir = os.path.join(get_session_spool_root(), area)
+    file_names = sorted((name for name in os.listdir(area_dir) if output_filter is None or output_filter(name)),
+                        key=lambda name: (len(name), name)) if os.path.isdir(area_dir) else []
+    if file_names:
+        show_spooled_downloads(area, file_names, title)
+    else:
+        st.info("没有生成输出文件。")
+
+
+def toggle_picked_page(page_num, key):
+    picked = st.session_state.picked_pages['pages']
+    if st.session_state[key]:
+        picked.add(page_num)
+    else:
+        picked.discard(page_num)
+
+
+def show_page_picker(uploaded_file, info, password):
+    """在后台生成低 DPI 缩略图，生成后显示可勾选的缩略图，返回所选页面的范围字符串"""
+    content_hash = get_upload_hash(uploaded_file)
+    if info['encrypted']:
+        if not password:
+            return None
+        # 加密文档的缩略图只放在本会话目录中，随会话过期删除
+        thumb_dir = os.path.join(get_session_spool_root(), "thumbnails", content_hash)
+    else:
+        thumb_dir = os.path.join(THUMBNAIL_CACHE_DIR, f"{content_hash}_{THUMBNAIL_DPI}")
+
+    if not os.path.exists(os.path.join(thumb_dir, THUMBNAIL_INDEX_FILENAME)):
+        request = (thumb_dir, password)
+        if st.session_state.get('thumbnail_request') != request:
+            st.session_state.thumbnail_request = request
+            # 上一个文档的缩略图任务不再需要；它读取自己的输入文件，停止前不删除
+            stopped = cancel_job("thumbnails")
+            input_path = save_thumbnail_input(uploaded_file, content_hash)
+            if stopped:
+                remove_stale_thumbnail_inputs(input_path)
+            # 缩略图在一个任务进程中串行生成，与其他任务一样受 PDF_APP_JOB_WORKERS 和按会话调度的限制
+            submit_job("thumbnails", 'thumbnails', input_path, thumb_dir, THUMBNAIL_DPI, password)
+        job = get_job("thumbnails")
+        if job is not None and job['state'] in ACTIVE_STATES:
+            st.caption("正在生成缩略图...")
+            show_job_progress("thumbnails")
+        elif job is not None and job['state'] == 'failed':
+            st.caption(f"缩略图生成失败: {job['error']}")
+        return None
+
+    os.utime(thumb_dir)
+    if st.session_state.get('picked_pages', {}).get('hash') != content_hash:
+        st.session_state.picked_pages = {'hash': content_hash, 'pages': set()}
+    picked = st.session_state.picked_pages['pages']
+
+    with st.expander(f"按缩略图选择页面（已选 {len(picked)} 页）"):
+        page_count = info['page_count']
+        view_count = math.ceil(page_count / PICKER_PAGE_SIZE)
+        view = st.number_input(f"缩略图第几屏 (共 {view_count} 屏)", 1, view_count, 1) if view_count > 1 else 1
+        first_page = (view - 1) * PICKER_PAGE_SIZE + 1
+        columns = st.columns(PICKER_COLUMNS)
+        for i, page_num in enumerate(range(first_page, min(first_page + PICKER_PAGE_SIZE, page_count + 1))):
+            with columns[i % PICKER_COLUMNS]:
+                st.image(os.path.join(thumb_dir, f"page_{page_num}.png"))
+                key = f"pick_page_{page_num}"
+                st.session_state[key] = page_num in picked
+                st.checkbox(f"第 {page_num} 页", key=key, on_change=toggle_picked_page, args=(page_num, key))
+        if picked and st.button("清空选择"):
+            picked.clear()
+            st.rerun()
+    return format_page_ranges(picked)
+
 
 def process_pdf_ui():
     st.header("处理 PDF")
 
-    if 'processed_files' not in st.session_state:
-        st.session_state.processed_files = []
-
     uploaded_file = st.file_uploader("选择一个 PDF 文件", type="pdf")
     if uploaded_file is not None:
-        file_content = uploaded_file.getvalue()
-        is_encrypted = check_pdf_encryption(file_content)
+        info = get_upload_info(uploaded_file)
+        show_pdf_info(info)
 
         password = None
-        if is_encrypted:
+        if info['encrypted']:
             st.warning("这个 PDF 文件是加密的。请输入密码以解密。")
             password = st.text_input("输入密码", type="password")
 
-        page_range = st.text_input("输入页面范围 (例如: 1,3-5,7-9)，留空处理所有页面")
+        # 缩略图中勾选的页面变化时同步到页面范围输入框，之后仍可手动修改
+        picked_range = show_page_picker(uploaded_file, info, password)
+        if picked_range is not None and picked_range != st.session_state.get('last_picked_range', ''):
+            st.session_state.process_page_range = picked_range
+            st.session_state.last_picked_range = picked_range
+        page_range = st.text_input("输入页面范围 (例如: 1,3-5,7-9)，留空处理所有页面", key="process_page_range")
         output_format = st.selectbox("选择输出格式", ["pdf", "png", "jpg"])
         dpi = st.slider("选择 DPI (仅用于图片输出)", 72, 600, 300)
+        encoding = st.selectbox("图片编码预设 (fast 最快，balanced 兼顾，smallest 最小)", list(ENCODING_PRESETS),
+                                index=list(ENCODING_PRESETS).index(DEFAULT_PRESET))
         split_pages = st.checkbox("分割页面")
 
-        if st.button("处理"):
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_input:
-                tmp_input.write(file_content)
-                tmp_input_path = tmp_input.name
-
-            try:
-                with tempfile.TemporaryDirectory() as tmp_dir:
-                    base_name = os.path.join(tmp_dir, "output")
-                    process_pdf(tmp_input_path, page_range, f"{base_name}.{output_format}", dpi, split_pages, password)
-
-                    output_files = [f for f in os.listdir(tmp_dir) if f.endswith(f'.{output_format}')]
-
-                    st.session_state.processed_files = []
-                    for file in sorted(output_files):
-                        with open(os.path.join(tmp_dir, file), "rb") as f:
-                            file_content = f.read()
-                            st.session_state.processed_files.append({
-                                'name': file,
-                                'content': file_content,
-                                'mime': f"application/{output_format}" if output_format == 'pdf' else f"image/{output_format}",
-                                'key': str(uuid.uuid4())
-                            })
-
-                    st.success("文件处理完成！")
-
-            except Exception as e:
-                st.error(f"处理过程中出错: {str(e)}")
-            finally:
-                os.unlink(tmp_input_path)
-
-    if st.session_state.processed_files:
-        st.write("处理后的文件:")
-        for file in st.session_state.processed_files:
-            st.download_button(
-                label=f"下载 {file['name']}",
-                data=file['content'],
-                file_name=file['name'],
-                mime=file['mime'],
-                key=file['key']
-            )
+        if st.button("处理", disabled=job_active("process")):
+            input_path, = save_uploads("process", [uploaded_file])
+            spool_dir = reset_session_spool("process")
+            submit_job("process", 'process', input_path, page_range, os.path.join(spool_dir, f"output.{output_format}"),
+                       dpi, split_pages, password, cache=get_page_cache(), encoding=encoding)
+
+    show_job_result("process", "处理后的文件")
 
 
 def merge_pdfs_ui():
     st.header("合并 PDF")
     uploaded_files = st.file_uploader("选择多个 PDF 文件", type="pdf", accept_multiple_files=True)
     if uploaded_files:
-        if st.button("合并"):
-            try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_output:
-                    tmp_output_path = tmp_output.name
-
-                input_paths = []
-                for uploaded_file in uploaded_files:
-                    with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_input:
-                        tmp_input.write(uploaded_file.getvalue())
-                        input_paths.append(tmp_input.name)
-
-                merge_pdfs(input_paths, tmp_output_path)
-
-                with open(tmp_output_path, "rb") as file:
-                    st.download_button(
-                        label="下载合并后的 PDF",
-                        data=file,
-                        file_name="merged.pdf",
-                        mime="application/pdf"
-                    )
-            except Exception as e:
-                st.error(f"合并过程中出错: {str(e)}")
-            finally:
-                for path in input_paths:
-                    os.unlink(path)
-                os.unlink(tmp_output_path)
+        total_pages = sum(get_upload_info(uploaded_file)['page_count'] for uploaded_file in uploaded_files)
+        st.caption(f"共 {len(uploaded_files)} 个文件，{total_pages} 页")
+        if st.button("合并", disabled=job_active("merge")):
+            input_paths = save_uploads("merge", uploaded_files)
+            spool_dir = reset_session_spool("merge")
+            submit_job("merge", 'merge', input_paths, os.path.join(spool_dir, "merged.pdf"))
+
+    show_job_result("merge", "合并后的 PDF")
 
 
 def extract_images_ui():
     st.header("提取图片")
 
-    if 'extracted_images' not in st.session_state:
-        st.session_state.extracted_images = []
-
     uploaded_file = st.file_uploader("选择一个 PDF 文件", type="pdf", key="extract_pdf_uploader")
     if uploaded_file is not None:
-        file_content = uploaded_file.getvalue()
-        is_encrypted = check_pdf_encryption(file_content)
+        info = get_upload_info(uploaded_file)
+        show_pdf_info(info)
 
-        if is_encrypted:
+        if info['encrypted']:
             st.warning("这个 PDF 文件是加密的。请输入密码以解密。")
             password = st.text_input("输入密码", type="password", key="extract_password")
         else:
             password = None
 
         page_range = st.text_input("输入页面范围 (例如: 1,3-5,7-9)，留空处理所有页面", key="extract_page_range")
-        if st.button("提取图片", key="extract_button"):
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_input:
-                tmp_input.write(file_content)
-                tmp_input_path = tmp_input.name
-
-            with tempfile.TemporaryDirectory() as tmp_dir:
-                try:
-                    extract_images_from_pdf(tmp_input_path, page_range, tmp_dir, password)
-
-                    st.session_state.extracted_images = []
-                    for filename in os.listdir(tmp_dir):
-                        with open(os.path.join(tmp_dir, filename), "rb") as file:
-                            file_content = file.read()
-                            st.session_state.extracted_images.append({
-                                'name': filename,
-                                'content': file_content,
-                                'mime': "image/png",
-                                'key': str(uuid.uuid4())
-                            })
-
-                    st.success("图片提取完成！")
-                except Exception as e:
-                    st.error(f"提取图片过程中出错: {str(e)}")
-                finally:
-                    os.unlink(tmp_input_path)
-
-    if st.session_state.extracted_images:
-        st.write("提取的图片:")
-        for img in st.session_state.extracted_images:
-            st.download_button(
-                label=f"下载 {img['name']}",
-                data=img['content'],
-                file_name=img['name'],
-                mime=img['mime'],
-                key=img['key']
-            )
+        if st.button("提取图片", key="extract_button", disabled=job_active("extract")):
+            input_path, = save_uploads("extract", [uploaded_file])
+            spool_dir = reset_session_spool("extract")
+            submit_job("extract", 'extract', input_path, page_range, spool_dir, password)
+
+    show_job_result("extract", "提取的图片", lambda name: name != IMAGE_INDEX_FILENAME)
 
 
 def encrypt_pdf_ui():
@@ -176,29 +452,13 @@ def encrypt_pdf_ui():
     if uploaded_file is not None:
         user_password = st.text_input("设置用户密码", type="password")
         owner_password = st.text_input("设置所有者密码 (可选)", type="password")
-        if st.button("加密"):
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_input:
-                tmp_input.write(uploaded_file.getvalue())
-                tmp_input_path = tmp_input.name
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_output:
-                tmp_output_path = tmp_output.name
-
-            try:
-                encrypt_pdf(tmp_input_path, tmp_output_path, user_password, owner_password)
-
-                with open(tmp_output_path, "rb") as file:
-                    st.download_button(
-                        label="下载加密后的 PDF",
-                        data=file,
-                        file_name="encrypted.pdf",
-                        mime="application/pdf"
-                    )
-            except Exception as e:
-                st.error(f"加密过程中出错: {str(e)}")
-            finally:
-                os.unlink(tmp_input_path)
-                os.unlink(tmp_output_path)
+        if st.button("加密", disabled=job_active("encrypt")):
+            input_path, = save_uploads("encrypt", [uploaded_file])
+            spool_dir = reset_session_spool("encrypt")
+            submit_job("encrypt", 'encrypt', input_path, os.path.join(spool_dir, "encrypted.pdf"), user_password,
+                       owner_password)
+
+    show_job_result("encrypt", "加密后的 PDF")
 
 
 def decrypt_pdf_ui():
@@ -206,50 +466,42 @@ def decrypt_pdf_ui():
     uploaded_file = st.file_uploader("选择一个加密的 PDF 文件", type="pdf")
     if uploaded_file is not None:
         password = st.text_input("输入密码", type="password")
-        if st.button("解密"):
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_input:
-                tmp_input.write(uploaded_file.getvalue())
-                tmp_input_path = tmp_input.name
-
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_output:
-                tmp_output_path = tmp_output.name
-
-            try:
-                decrypt_pdf(tmp_input_path, tmp_output_path, password)
-
-                with open(tmp_output_path, "rb") as file:
-                    st.download_button(
-                        label="下载解密后的 PDF",
-                        data=file,
-                        file_name="decrypted.pdf",
-                        mime="application/pdf"
-                    )
-            except Exception as e:
-                st.error(f"解密过程中出错: {str(e)}")
-            finally:
-                os.unlink(tmp_input_path)
-                os.unlink(tmp_output_path)
+        if st.button("解密", disabled=job_active("decrypt")):
+            input_path, = save_uploads("decrypt", [uploaded_file])
+            spool_dir = reset_session_spool("decrypt")
+            submit_job("decrypt", 'decrypt', input_path, os.path.join(spool_dir, "decrypted.pdf"), password)
+
+    show_job_result("decrypt", "解密后的 PDF")
+
+
+FUNCTION_AREAS = {
+    "处理 PDF": "process",
+    "合并 PDF": "merge",
+    "提取图片": "extract",
+    "加密 PDF": "encrypt",
+    "解密 PDF": "decrypt",
+}
 
 
 def main():
     st.title("PDF 处理工具")
+    start_session_sweeper()
+    get_session_spool_root()
 
     # 侧边栏用于选择功能
     option = st.sidebar.selectbox(
         "选择功能",
-        ("处理 PDF", "合并 PDF", "提取图片", "加密 PDF", "解密 PDF")
+        tuple(FUNCTION_AREAS)
     )
 
     # 为每个功能创建一个独立的 session state
     if 'current_function' not in st.session_state:
         st.session_state.current_function = None
 
-    # 如果功能改变，清除之前功能的状态
+    # 如果功能改变，清除之前功能已结束的任务和输出，仍在运行的任务保留
     if st.session_state.current_function != option:
-        if st.session_state.current_function == "提取图片":
-            st.session_state.extracted_images = []
-        elif st.session_state.current_function == "处理 PDF":
-            st.session_state.processed_files = []
+        if st.session_state.current_function in FUNCTION_AREAS:
+            clear_job(FUNCTION_AREAS[st.session_state.current_function])
         st.session_state.current_function = option
 
     if option == "处理 PDF":
@@ -265,4 +517,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,159 @@
+import json
+import os
+import shutil
+import tempfile
+import fitz  # PyMuPDF
+from PIL import Image
+
+# 基准测试 (pdf_benchmark.py backends --write-routing) 写入的路由表
+ROUTING_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pdf_backend_routing.json")
+# 没有基准测试结果时，各类文档都使用 PyMuPDF
+DEFAULT_ROUTING = {'text': 'pymupdf', 'scanned': 'pymupdf', 'vector': 'pymupdf'}
+
+
+class RenderBackend:
+    """渲染后端接口：按页码顺序产出 PIL 图像，以及合并 PDF"""
+    name = None
+
+    @classmethod
+    def is_available(cls):
+        return True
+
+    def page_count(self, pdf_path, password=None):
+        raise NotImplementedError
+
+    def iter_pages(self, pdf_path, pages, dpi, password=None):
+        """按页码顺序逐页产出 (页码, PIL 图像)，调用方处理完一页后再取下一页"""
+        raise NotImplementedError
+
+    def merge(self, input_pdfs, output_path):
+        raise NotImplementedError
+
+
+class PyMuPDFBackend(RenderBackend):
+    name = 'pymupdf'
+
+    def page_count(self, pdf_path, password=None):
+        from pdf_tool import open_pdf
+        doc = open_pdf(pdf_path, password)
+        try:
+            return len(doc)
+        finally:
+            doc.close()
+
+    def iter_pages(self, pdf_path, pages, dpi, password=None, cache=None):
+        from pdf_tool import open_pdf, render_page, pixmap_to_image, PageCache, is_encrypted_pdf
+        doc = open_pdf(pdf_path, password)
+        try:
+            doc_hash = PageCache.hash_file(pdf_path) if cache and not is_encrypted_pdf(doc) else None
+            zoom = dpi / 72
+            mat = fitz.Matrix(zoom, zoom)
+            for page_num in pages:
+                pix = render_page(doc[page_num - 1], mat, dpi, cache, doc_hash)
+                yield page_num, pixmap_to_image(pix)
+        finally:
+            doc.close()
+
+    def merge(self, input_pdfs, output_path):
+        from pdf_tool import merge_pdfs
+        merge_pdfs(input_pdfs, output_path)
+
+
+class PopplerBackend(RenderBackend):
+    """PyPDF2 读取结构，pdf2image 调用 poppler 渲染"""
+    name = 'poppler'
+
+    @classmethod
+    def is_available(cls):
+        try:
+            import pdf2image  # noqa: F401
+            import PyPDF2  # noqa: F401
+        except ImportError:
+            return False
+        return shutil.which('pdftoppm') is not None
+
+    def page_count(self, pdf_path, password=None):
+        from pdf_processor import open_pdf_reader
+        return len(open_pdf_reader(pdf_path, password).pages)
+
+    def iter_pages(self, pdf_path, pages, dpi, password=None, cache=None):
+        from pdf_processor import iter_rendered_pages
+        spool_dir = tempfile.mkdtemp()
+        try:
+            for page_num, path in iter_rendered_pages(pdf_path, pages, dpi, spool_dir, password=password):
+                with Image.open(path) as img:
+                    img.load()
+                os.remove(path)
+                yield page_num, img
+        finally:
+            shutil.rmtree(spool_dir, ignore_errors=True)
+
+    def merge(self, input_pdfs, output_path):
+        from pdf_processor import merge_pdfs
+        merge_pdfs(input_pdfs, output_path)
+
+
+BACKENDS = {backend.name: backend for backend in (PyMuPDFBackend, PopplerBackend)}
+
+
+def get_backend(name):
+    if name not in BACKENDS:
+        raise ValueError(f"不支持的渲染后端: {name}，可选: {', '.join(BACKENDS)}")
+    backend_class = BACKENDS[name]
+    if not backend_class.is_available():
+        raise ValueError(f"渲染后端 {name} 不可用，请检查依赖是否已安装")
+    return backend_class()
+
+
+def classify_pdf(pdf_path, password=None, sample_pages=5):
+    """抽样判断文档类型：scanned（整页图片）、vector（大量矢量图形）或 text（以文字为主）
+
+    pdf_path 也可以是已打开的文档，此时不会关闭它。
+    """
+    from pdf_tool import open_pdf
+    owns_doc = not isinstance(pdf_path, fitz.Document)
+    doc = open_pdf(pdf_path, password)
+    try:
+        if len(doc) == 0:
+            return 'text'
+        step = max(1, len(doc) // sample_pages)
+        sampled = list(range(0, len(doc), step))[:sample_pages]
+
+        image_coverage = 0.0
+        drawings = 0
+        text_chars = 0
+        for index in sampled:
+            page = doc[index]
+            page_area = abs(page.rect) or 1
+            covered = sum(abs(rect & page.rect) for img in page.get_images() for rect in page.get_image_rects(img[0]))
+            image_coverage += min(1.0, covered / page_area)
+            drawings += len(page.get_cdrawings())
+            text_chars += len(page.get_text().strip())
+
+        count = len(sampled)
+        if image_coverage / count > 0.6 and text_chars / count < 200:
+            return 'scanned'
+        if drawings / count > 500:
+            return 'vector'
+        return 'text'
+    finally:
+        if owns_doc:
+            doc.close()
+
+
+def load_routing(routing_path=None):
+    routing = dict(DEFAULT_ROUTING)
+    routing_path = routing_path or ROUTING_FILE
+    if os.path.exists(routing_path):
+        with open(routing_path, 'r', encoding='utf-8') as f:
+            routing.update(json.load(f))
+    return routing
+
+
+def select_backend(pdf_path, password=None, routing_path=None):
+    """按文档类型和基准测试得出的路由表选择后端，不可用时回退到 PyMuPDF"""
+    doc_type = classify_pdf(pdf_path, password)
+    name = load_routing(routing_path).get(doc_type, 'pymupdf')
+    if name not in BACKENDS or not BACKENDS[name].is_available():
+        name = 'pymupdf'
+    return name, doc_type
@@ -0,0 +1,389 @@
+import argparse
+import contextlib
+import io
+import json
+import mmap
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+import fitz  # PyMuPDF
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from PIL import Image
+from pdf_tool import process_pdf, pixmap_to_image, merge_pdfs, open_pdf
+from pdf_backends import BACKENDS, ROUTING_FILE, classify_pdf, get_backend
+from pdf_encoding import ENCODING_PRESETS, EncodeStats, save_page_image
+
+
+def make_sample_pdf(path, pages=50):
+    """生成用于测试的 PDF：每页若干行文字和几何图形"""
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        for line in range(40):
+            page.insert_text((50, 60 + line * 18), f"第 {i + 1} 页 第 {line + 1} 行 The quick brown fox jumps over the lazy dog",
+                             fontsize=10)
+        page.draw_rect(fitz.Rect(50, 600, 300, 780), color=(0, 0, 1), fill=(0.8, 0.9, 1))
+        page.draw_circle(fitz.Point(420, 690), 80, color=(1, 0, 0), fill=(1, 0.9, 0.8))
+    doc.save(path)
+    doc.close()
+
+
+def make_scanned_pdf(path, pages=10):
+    """生成模拟扫描件的 PDF：每页一张铺满页面的灰度噪点图片"""
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        img = Image.effect_noise((1240, 1754), 40 + i)
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=75)
+        page.insert_image(page.rect, stream=buffer.getvalue())
+    doc.save(path)
+    doc.close()
+
+
+def make_large_scanned_pdf(path, size_mb=2048, chunk_pages=50):
+    """生成约 size_mb 大小的扫描件 PDF，每页一张不同的噪点图片；分块增量保存，生成时不在内存中保留整个文档"""
+    page_num = 0
+    while not os.path.exists(path) or os.path.getsize(path) < size_mb * 1024 ** 2:
+        doc = fitz.open(path) if os.path.exists(path) else fitz.open()
+        for _ in range(chunk_pages):
+            page = doc.new_page()
+            img = Image.effect_noise((2480, 3508), 40 + page_num % 60)
+            buffer = io.BytesIO()
+            img.save(buffer, format='JPEG', quality=90)
+            page.insert_image(page.rect, stream=buffer.getvalue())
+            page_num += 1
+        if doc.name:
+            doc.saveIncr()
+        else:
+            doc.save(path)
+        doc.close()
+
+
+def make_vector_pdf(path, pages=10, shapes=3000):
+    """生成矢量图形密集的 PDF：每页数千条线段和多边形"""
+    doc = fitz.open()
+    for i in range(pages):
+        page = doc.new_page()
+        shape = page.new_shape()
+        for j in range(shapes):
+            x = (j * 37 + i * 11) % 560 + 20
+            y = (j * 53 + i * 7) % 800 + 20
+            shape.draw_line(fitz.Point(x, y), fitz.Point(x + 15, y + (j % 9)))
+            shape.finish(color=((j % 7) / 7, (j % 5) / 5, (j % 3) / 3), width=0.5)
+        shape.commit()
+    doc.save(path)
+    doc.close()
+
+
+def run_quietly(func, *args, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return func(*args, **kwargs)
+
+
+def benchmark_render(input_pdf, page_range, dpi, workers_list):
+    with fitz.open(input_pdf) as doc:
+        total_pages = len(doc)
+    print(f"文件: {input_pdf}，共 {total_pages} 页，DPI: {dpi}")
+
+    for workers in workers_list:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_path = os.path.join(tmp_dir, "page.png")
+            start = time.perf_counter()
+            run_quietly(process_pdf, input_pdf, page_range, output_path, dpi, True, workers=workers)
+            elapsed = time.perf_counter() - start
+            page_count = len(os.listdir(tmp_dir))
+        mode = "串行" if workers == 1 else f"{workers} 进程"
+        print(f"{mode:>8}: {page_count} 页, 耗时 {elapsed:.2f} 秒, {page_count / elapsed:.2f} 页/秒")
+
+
+def run_isolated(func, *args):
+    """在独立的子进程中运行，返回 (耗时秒数, 子进程峰值内存MB)"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        return executor.submit(_measure, func, *args).result()
+
+
+def _measure(func, *args):
+    start = time.perf_counter()
+    run_quietly(func, *args)
+    elapsed = time.perf_counter() - start
+    # Linux 下 ru_maxrss 单位为 KB，macOS 下为字节
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    scale = 1024 ** 2 if os.uname().sysname == 'Darwin' else 1024
+    return elapsed, max_rss / scale
+
+
+def merge_in_memory(input_pdfs, output_path):
+    """旧版合并方式：所有输入累积在一个内存文档中，最后一次性保存"""
+    merged_doc = fitz.open()
+    for pdf_path in input_pdfs:
+        with fitz.open(pdf_path) as doc:
+            merged_doc.insert_pdf(doc)
+    merged_doc.save(output_path)
+
+
+def benchmark_merge(input_pdfs, tmp_dir, chunk_size, include_optimize=False):
+    total_bytes = sum(os.path.getsize(path) for path in input_pdfs)
+    print(f"合并 {len(input_pdfs)} 个文件，共 {total_bytes / 1024 ** 2:.1f} MB")
+    variants = [
+        ("一次性内存合并", merge_in_memory, ()),
+        (f"分块增量合并(每块{chunk_size})", merge_pdfs, (chunk_size,)),
+    ]
+    if include_optimize:
+        variants.append(("分块增量合并+去重", merge_pdfs, (chunk_size, True)))
+    for i, (name, func, extra_args) in enumerate(variants):
+        output_path = os.path.join(tmp_dir, f"merged_{i}.pdf")
+        elapsed, peak_mb = run_isolated(func, input_pdfs, output_path, *extra_args)
+        size_mb = os.path.getsize(output_path) / 1024 ** 2
+        print(f"{name}: 耗时 {elapsed:.2f} 秒, 峰值内存 {peak_mb:.1f} MB, 输出 {size_mb:.1f} MB")
+
+
+def render_with_backend(backend_name, input_pdf, dpi):
+    with fitz.open(input_pdf) as doc:
+        pages = range(1, len(doc) + 1)
+    for _ in get_backend(backend_name).iter_pages(input_pdf, pages, dpi):
+        pass
+
+
+def benchmark_backends(samples, dpi, write_routing=False):
+    """各后端分别渲染每类样本文件，输出耗时和峰值内存，并得出每类文档最快的后端"""
+    available = [name for name, backend in BACKENDS.items() if backend.is_available()]
+    skipped = [name for name in BACKENDS if name not in available]
+    if skipped:
+        print(f"不可用的后端（已跳过）: {', '.join(skipped)}")
+    print(f"DPI: {dpi}")
+
+    routing = {}
+    for doc_type, input_pdf in samples:
+        detected = classify_pdf(input_pdf)
+        with fitz.open(input_pdf) as doc:
+            page_count = len(doc)
+        results = []
+        for name in available:
+            elapsed, peak_mb = run_isolated(render_with_backend, name, input_pdf, dpi)
+            results.append((elapsed, name))
+            print(f"{doc_type:>8} ({page_count} 页, 识别为 {detected}) {name:>8}: 耗时 {elapsed:.2f} 秒, "
+                  f"{page_count / elapsed:.2f} 页/秒, 峰值内存 {peak_mb:.1f} MB")
+        routing[doc_type] = min(results)[1]
+
+    print("各类文档最快的后端: " + ", ".join(f"{doc_type} -> {name}" for doc_type, name in routing.items()))
+    if write_routing:
+        with open(ROUTING_FILE, 'w', encoding='utf-8') as f:
+            json.dump(routing, f, ensure_ascii=False, indent=2)
+        print(f"路由表已写入: {ROUTING_FILE}")
+
+
+def read_memory_status():
+    """读取当前进程的常驻内存构成 (MB)，仅 Linux 可用。
+
+    RssAnon 为进程私有的匿名内存；RssFile 为映射文件的页面，属于系统页缓存，多个进程映射同一文件时共享，可随时回收。
+    """
+    status = {}
+    try:
+        with open('/proc/self/status', 'r', encoding='utf-8') as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                if key in ('VmHWM', 'RssAnon', 'RssFile'):
+                    status[key] = int(value.split()[0]) / 1024
+    except FileNotFoundError:
+        pass
+    return status
+
+
+def _open_and_render(mode, input_pdf, dpi, max_pages):
+    """在子进程中按指定方式打开文档并渲染前几页，返回 (耗时秒数, 内存构成)"""
+    start = time.perf_counter()
+    if mode == 'read':
+        with open(input_pdf, 'rb') as f:
+            source = f.read()
+    elif mode == 'mmap':
+        with open(input_pdf, 'rb') as f:
+            source = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    else:
+        source = input_pdf
+    doc = open_pdf(source)
+    zoom = dpi / 72
+    mat = fitz.Matrix(zoom, zoom)
+    for page in doc.pages(0, min(max_pages, len(doc))):
+        page.get_pixmap(matrix=mat)
+    elapsed = time.perf_counter() - start
+    return elapsed, read_memory_status()
+
+
+def benchmark_memory(input_pdf, dpi, max_pages):
+    """对比整体读入内存、内存映射和按路径打开三种方式的常驻内存"""
+    size_mb = os.path.getsize(input_pdf) / 1024 ** 2
+    print(f"文件: {input_pdf} ({size_mb:.0f} MB)，渲染前 {max_pages} 页，DPI: {dpi}")
+    for mode, name in (('read', '整体读入内存'), ('mmap', '内存映射'), ('path', '按路径打开')):
+        try:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                elapsed, status = executor.submit(_open_and_render, mode, input_pdf, dpi, max_pages).result()
+        except BrokenProcessPool:
+            print(f"{name:>8}: 子进程异常退出")
+            continue
+        except ValueError as e:
+            print(f"{name:>8}: {str(e)}")
+            continue
+        if not status:
+            print(f"{name:>8}: 耗时 {elapsed:.2f} 秒（非 Linux 系统，无法读取内存构成）")
+            continue
+        print(f"{name:>8}: 耗时 {elapsed:.2f} 秒, 峰值常驻 {status['VmHWM']:.0f} MB, "
+              f"私有匿名内存 {status['RssAnon']:.0f} MB, 文件映射 {status['RssFile']:.0f} MB")
+
+
+def benchmark_encoding(input_pdf, dpi, max_pages, formats, log_path=None):
+    """同一批渲染结果分别用各编码预设保存，比较每页编码耗时和输出大小"""
+    with fitz.open(input_pdf) as doc:
+        page_count = min(len(doc), max_pages)
+        print(f"文件: {input_pdf}，测试前 {page_count} 页，DPI: {dpi}")
+        zoom = dpi / 72
+        mat = fitz.Matrix(zoom, zoom)
+        pixmaps = [doc[page_num].get_pixmap(matrix=mat, alpha=False) for page_num in range(page_count)]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for output_format in formats:
+            for preset_name in ENCODING_PRESETS:
+                stats = EncodeStats(preset_name)
+                for page_num, pix in enumerate(pixmaps, 1):
+                    page_path = os.path.join(tmp_dir, f"{preset_name}_{page_num}.{output_format}")
+                    save_page_image(pixmap_to_image(pix), page_path, preset_name, stats, page_num)
+                    os.remove(page_path)
+                summary = stats.summary()
+                print(f"{output_format:>4} {preset_name:>8}: {summary['ms_per_image']:8.1f} 毫秒/页, "
+                      f"{summary['bytes_per_image'] / 1024:8.1f} KB/页")
+                if log_path:
+                    stats.write_log(log_path)
+
+
+def benchmark_convert(input_pdf, dpi_list, max_pages):
+    with fitz.open(input_pdf) as doc:
+        page_count = min(len(doc), max_pages)
+        print(f"文件: {input_pdf}，测试前 {page_count} 页")
+        for dpi in dpi_list:
+            zoom = dpi / 72
+            mat = fitz.Matrix(zoom, zoom)
+            png_time = 0.0
+            buffer_time = 0.0
+            for page_num in range(page_count):
+                pix = doc[page_num].get_pixmap(matrix=mat, alpha=False)
+
+                start = time.perf_counter()
+                img = Image.open(io.BytesIO(pix.tobytes()))
+                img.load()
+                png_time += time.perf_counter() - start
+
+                start = time.perf_counter()
+                img = pixmap_to_image(pix)
+                img.load()
+                buffer_time += time.perf_counter() - start
+
+            png_ms = png_time / page_count * 1000
+            buffer_ms = buffer_time / page_count * 1000
+            print(f"DPI {dpi:>4}: PNG 往返 {png_ms:8.2f} 毫秒/页, 直接包装 {buffer_ms:8.2f} 毫秒/页, "
+                  f"每页节省 {png_ms - buffer_ms:8.2f} 毫秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pdf_tool 性能测试")
+    subparsers = parser.add_subparsers(dest='command', help='可用的测试')
+
+    render_parser = subparsers.add_parser('render', help='对比串行与多进程渲染的吞吐量')
+    render_parser.add_argument("input_pdf", nargs='?', help="输入PDF文件的路径（不提供则生成测试文件）")
+    render_parser.add_argument("-r", "--page-range", default="", help="要渲染的页面范围，留空为全部页面")
+    render_parser.add_argument("-d", "--dpi", type=int, default=150, help="图像DPI (默认: 150)")
+    render_parser.add_argument("-w", "--workers", type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 1],
+                               help="要对比的进程数列表 (默认: 1 2 4 CPU核心数)")
+    render_parser.add_argument("-n", "--pages", type=int, default=50, help="生成测试文件的页数 (默认: 50)")
+
+    convert_parser = subparsers.add_parser('convert', help='对比 pixmap 转 PIL 图像的 PNG 往返与直接包装缓冲区')
+    convert_parser.add_argument("input_pdf", nargs='?', help="输入PDF文件的路径（不提供则生成测试文件）")
+    convert_parser.add_argument("-d", "--dpi", type=int, nargs='+', default=[150, 300, 600],
+                                help="要对比的DPI列表 (默认: 150 300 600)")
+    convert_parser.add_argument("-n", "--pages", type=int, default=10, help="测试的页数 (默认: 10)")
+
+    merge_parser = subparsers.add_parser('merge', help='对比一次性内存合并与分块增量合并的耗时和峰值内存')
+    merge_parser.add_argument("input_pdfs", nargs='*', help="要合并的PDF文件（不提供则生成测试文件）")
+    merge_parser.add_argument("-n", "--files", type=int, default=200, help="生成测试文件的数量 (默认: 200)")
+    merge_parser.add_argument("-c", "--chunk-size", type=int, default=50, help="每块文件数 (默认: 50)")
+    merge_parser.add_argument("--optimize", action='store_true', help="同时测试合并后去重 (merge --optimize)，耗时较长")
+
+    encode_parser = subparsers.add_parser('encode', help='对比各图片编码预设的每页编码耗时和输出大小')
+    encode_parser.add_argument("input_pdf", nargs='?', help="输入PDF文件的路径（不提供则生成测试文件）")
+    encode_parser.add_argument("-d", "--dpi", type=int, default=300, help="图像DPI (默认: 300)")
+    encode_parser.add_argument("-n", "--pages", type=int, default=5, help="测试的页数 (默认: 5)")
+    encode_parser.add_argument("-f", "--format", nargs='+', default=['png', 'jpg'], choices=['png', 'jpg'],
+                               help="要对比的输出格式 (默认: png jpg)")
+    encode_parser.add_argument("--log", help="以JSON Lines格式追加每页记录的文件")
+    encode_parser.add_argument("--scanned", action='store_true', help="不提供 input_pdf 时生成扫描件测试文件")
+
+    backends_parser = subparsers.add_parser('backends', help='对比各渲染后端在文字、扫描件、矢量图形三类文档上的耗时和峰值内存')
+    backends_parser.add_argument("-d", "--dpi", type=int, default=150, help="图像DPI (默认: 150)")
+    backends_parser.add_argument("-n", "--pages", type=int, default=10, help="每类测试文件的页数 (默认: 10)")
+    backends_parser.add_argument("--write-routing", action='store_true',
+                                 help="将每类文档最快的后端写入路由表，供 process --backend auto 使用")
+
+    memory_parser = subparsers.add_parser('memory', help='对比大文件整体读入、按路径打开和内存映射的常驻内存')
+    memory_parser.add_argument("input_pdf", nargs='?', help="输入PDF文件的路径（不提供则生成扫描件测试文件）")
+    memory_parser.add_argument("-s", "--size-mb", type=int, default=2048, help="生成测试文件的大小，单位 MB (默认: 2048)")
+    memory_parser.add_argument("-d", "--dpi", type=int, default=72, help="图像DPI (默认: 72)")
+    memory_parser.add_argument("-n", "--pages", type=int, default=20, help="渲染的页数 (默认: 20)")
+
+    args = parser.parse_args()
+
+    if args.command == 'render':
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_pdf = args.input_pdf
+            if not input_pdf:
+                input_pdf = os.path.join(tmp_dir, "sample.pdf")
+                make_sample_pdf(input_pdf, args.pages)
+            benchmark_render(input_pdf, args.page_range, args.dpi, sorted(set(args.workers)))
+    elif args.command == 'convert':
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_pdf = args.input_pdf
+            if not input_pdf:
+                input_pdf = os.path.join(tmp_dir, "sample.pdf")
+                make_sample_pdf(input_pdf, args.pages)
+            benchmark_convert(input_pdf, args.dpi, args.pages)
+    elif args.command == 'merge':
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_pdfs = args.input_pdfs
+            if not input_pdfs:
+                input_pdfs = []
+                for i in range(args.files):
+                    path = os.path.join(tmp_dir, f"input_{i}.pdf")
+                    make_sample_pdf(path, 5)
+                    input_pdfs.append(path)
+            benchmark_merge(input_pdfs, tmp_dir, args.chunk_size, args.optimize)
+    elif args.command == 'encode':
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_pdf = args.input_pdf
+            if not input_pdf:
+                input_pdf = os.path.join(tmp_dir, "sample.pdf")
+                (make_scanned_pdf if args.scanned else make_sample_pdf)(input_pdf, args.pages)
+            benchmark_encoding(input_pdf, args.dpi, args.pages, args.format, args.log)
+    elif args.command == 'backends':
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            samples = []
+            for doc_type, make_pdf in (('text', make_sample_pdf), ('scanned', make_scanned_pdf),
+                                       ('vector', make_vector_pdf)):
+                path = os.path.join(tmp_dir, f"{doc_type}.pdf")
+                make_pdf(path, args.pages)
+                samples.append((doc_type, path))
+            benchmark_backends(samples, args.dpi, args.write_routing)
+    elif args.command == 'memory':
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            input_pdf = args.input_pdf
+            if not input_pdf:
+                input_pdf = os.path.join(tmp_dir, "large.pdf")
+                print(f"正在生成约 {args.size_mb} MB 的测试文件...")
+                make_large_scanned_pdf(input_pdf, args.size_mb)
+            benchmark_memory(input_pdf, args.dpi, args.pages)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import io
+import json
+import os
+import time
+from PIL import Image, ImageChops
+
+# 页面图片的编码预设：
+#   fast      低压缩级别，不做任何检测，编码最快
+#   balanced  默认压缩级别，无损地把灰度页存为单通道、颜色不超过 256 种的页面存为调色板 PNG
+#   smallest  最高压缩级别并优化，近似灰度的扫描页转为灰度，文字页量化为少量颜色
+ENCODING_PRESETS = {
+    'fast': {
+        'png_compress_level': 1,
+        'png_optimize': False,
+        'jpeg_quality': 85,
+        'jpeg_subsampling': '4:2:0',
+        'jpeg_optimize': False,
+        'gray_tolerance': None,
+        'palette': None,
+    },
+    'balanced': {
+        'png_compress_level': 6,
+        'png_optimize': False,
+        'jpeg_quality': 85,
+        'jpeg_subsampling': '4:2:0',
+        'jpeg_optimize': True,
+        'gray_tolerance': 0,
+        'palette': 'exact',
+    },
+    'smallest': {
+        'png_compress_level': 9,
+        'png_optimize': True,
+        'jpeg_quality': 75,
+        'jpeg_subsampling': '4:2:0',
+        'jpeg_optimize': True,
+        'gray_tolerance': 8,
+        'palette': 'quantize',
+    },
+}
+DEFAULT_PRESET = 'balanced'
+
+# smallest 预设下，白色像素占比超过该值的页面视为文字页，量化为 TEXT_PAGE_COLORS 种颜色
+TEXT_PAGE_WHITE_RATIO = 0.6
+TEXT_PAGE_COLORS = 64
+
+
+def get_preset(name):
+    if name not in ENCODING_PRESETS:
+        raise ValueError(f"不支持的编码预设: {name}，可选: {', '.join(ENCODING_PRESETS)}")
+    return ENCODING_PRESETS[name]
+
+
+def is_grayscale(img, tolerance=0):
+    """RGB 三个通道之间的最大差值不超过 tolerance 时视为灰度图"""
+    if img.mode in ('L', '1'):
+        return True
+    if img.mode != 'RGB':
+        return False
+    r, g, b = img.split()
+    return all(ImageChops.difference(a, b).getextrema()[1] <= tolerance for a, b in ((r, g), (g, b)))
+
+
+def is_text_page(img):
+    """白色（含接近白色）像素占多数的页面视为文字页"""
+    histogram = img.convert('L').histogram()
+    return sum(histogram[240:]) / (img.width * img.height) > TEXT_PAGE_WHITE_RATIO
+
+
+def prepare_image(img, output_format, preset):
+    """按预设做灰度检测和调色板转换，返回实际用于编码的图像"""
+    if img.mode not in ('RGB', 'L'):
+        img = img.convert('RGB')
+
+    tolerance = preset['gray_tolerance']
+    if tolerance is not None and img.mode == 'RGB' and is_grayscale(img, tolerance):
+        img = img.convert('L')
+
+    # 调色板只对 PNG 有效，灰度图本身就是单通道，无需再转换
+    if output_format == 'png' and preset['palette'] and img.mode == 'RGB':
+        colors = img.getcolors(256)
+        if colors is not None:
+            img = img.quantize(colors=len(colors), method=Image.Quantize.MEDIANCUT)
+        elif preset['palette'] == 'quantize' and is_text_page(img):
+            img = img.quantize(colors=TEXT_PAGE_COLORS, method=Image.Quantize.MEDIANCUT)
+    return img
+
+
+def save_options(output_format, preset):
+    if output_format in ('jpg', 'jpeg'):
+        return {'format': 'JPEG', 'quality': preset['jpeg_quality'], 'subsampling': preset['jpeg_subsampling'],
+                'optimize': preset['jpeg_optimize']}
+    return {'format': 'PNG', 'compress_level': preset['png_compress_level'], 'optimize': preset['png_optimize']}
+
+
+def output_format_of(path):
+    return os.path.splitext(path)[1][1:].lower()
+
+
+def save_page_image(img, path, preset_name=DEFAULT_PRESET, stats=None, page=None):
+    """按预设编码并保存页面图片，提供 stats 时记录该页的编码耗时和字节数"""
+    preset = get_preset(preset_name)
+    output_format = output_format_of(path)
+    start = time.perf_counter()
+    encoded = prepare_image(img, output_format, preset)
+    encoded.save(path, **save_options(output_format, preset))
+    if stats is not None:
+        stats.add(page, path, time.perf_counter() - start, os.path.getsize(path), encoded.mode)
+    return path
+
+
+def encode_page_image(img, output_format, preset_name=DEFAULT_PRESET, stats=None, page=None):
+    """按预设把页面图片编码到内存，返回编码后的字节串"""
+    preset = get_preset(preset_name)
+    output_format = output_format.lower()
+    start = time.perf_counter()
+    encoded = prepare_image(img, output_format, preset)
+    buffer = io.BytesIO()
+    encoded.save(buffer, **save_options(output_format, preset))
+    data = buffer.getvalue()
+    if stats is not None:
+        stats.add(page, None, time.perf_counter() - start, len(data), encoded.mode)
+    return data
+
+
+class EncodeStats:
+    """收集每页的编码耗时和输出字节数，用于比较不同预设"""
+
+    def __init__(self, preset_name=DEFAULT_PRESET):
+        self.preset = preset_name
+        self.records = []
+
+    def add(self, page, path, seconds, size, mode):
+        self.records.append({'preset': self.preset, 'page': page, 'output': path, 'seconds': round(seconds, 4),
+                             'bytes': size, 'mode': mode})
+
+    def extend(self, records):
+        self.records.extend(records)
+
+    def summary(self):
+        count = len(self.records)
+        total_seconds = sum(record['seconds'] for record in self.records)
+        total_bytes = sum(record['bytes'] for record in self.records)
+        return {
+            'preset': self.preset,
+            'images': count,
+            'seconds': total_seconds,
+            'bytes': total_bytes,
+            'ms_per_image': total_seconds / count * 1000 if count else 0.0,
+            'bytes_per_image': total_bytes / count if count else 0,
+        }
+
+    def write_log(self, log_path):
+        """以 JSON Lines 格式追加每页记录，多次运行的结果可以汇总比较"""
+        with open(log_path, 'a', encoding='utf-8') as f:
+            for record in self.records:
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
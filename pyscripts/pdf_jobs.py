@@ -0,0 +1,223 @@
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pdf_tool import process_pdf, merge_pdfs, extract_images_from_pdf, encrypt_pdf, decrypt_pdf, render_thumbnails
+from pdf_encoding import DEFAULT_PRESET, EncodeStats
+
+JOB_FUNCTIONS = {
+    'process': process_pdf,
+    'merge': merge_pdfs,
+    'extract': extract_images_from_pdf,
+    'encrypt': encrypt_pdf,
+    'decrypt': decrypt_pdf,
+    'thumbnails': render_thumbnails,
+}
+# 支持 progress 回调的任务，其余任务只在开始和结束时更新进度
+PROGRESS_JOBS = {'process', 'merge', 'extract', 'thumbnails'}
+# 仍在占用输出目录的任务状态
+ACTIVE_STATES = ('queued', 'running', 'cancelling')
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class ProgressReporter:
+    """在工作进程中把进度写入任务控制目录，并在每次回调时检查取消标记"""
+
+    def __init__(self, control_dir):
+        self.progress_path = os.path.join(control_dir, "progress.json")
+        self.cancel_path = os.path.join(control_dir, "cancel")
+
+    def __call__(self, done, total):
+        if os.path.exists(self.cancel_path):
+            raise JobCancelled()
+        tmp_path = f"{self.progress_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'done': done, 'total': total}, f)
+        os.replace(tmp_path, self.progress_path)
+
+
+def read_progress(control_dir):
+    try:
+        with open(os.path.join(control_dir, "progress.json"), 'r', encoding='utf-8') as f:
+            progress = json.load(f)
+        return progress['done'], progress['total']
+    except (FileNotFoundError, ValueError, KeyError):
+        return 0, 0
+
+
+def _run_job(kind, control_dir, args, kwargs):
+    """在工作进程中执行任务，返回需要展示给用户的统计信息"""
+    reporter = ProgressReporter(control_dir)
+    reporter(0, 0)
+    kwargs = dict(kwargs)
+    if kind in PROGRESS_JOBS:
+        kwargs['progress'] = reporter
+    encode_stats = None
+    if kind == 'process':
+        encode_stats = kwargs['encode_stats'] = EncodeStats(kwargs.get('encoding', DEFAULT_PRESET))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        JOB_FUNCTIONS[kind](*args, **kwargs)
+
+    info = {}
+    if encode_stats is not None and encode_stats.records:
+        info['encode'] = encode_stats.summary()
+    if kwargs.get('cache') is not None:
+        info['cache'] = kwargs['cache'].stats()
+    return info
+
+
+class JobManager:
+    """后台任务执行器：进程池加任务表。
+
+    提交的任务先进入各自所属会话的等待队列，有空闲进程时从正在运行任务最少的会话中
+    取最早提交的任务，避免单个用户的大批任务占满所有进程。
+    """
+
+    def __init__(self, max_workers=None, jobs_dir=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.jobs_dir = jobs_dir or os.path.join(tempfile.gettempdir(), "pdf_app_jobs")
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._pending = {}  # 会话 -> 等待中的任务 ID 队列
+        self._running = {}  # 会话 -> 正在运行的任务数
+
+    def submit(self, owner, kind, *args, **kwargs):
+        if kind not in JOB_FUNCTIONS:
+            raise ValueError(f"不支持的任务类型: {kind}")
+        job_id = uuid.uuid4().hex
+        control_dir = os.path.join(self.jobs_dir, job_id)
+        os.makedirs(control_dir)
+        with self._lock:
+            self._jobs[job_id] = {
+                'id': job_id,
+                'owner': owner,
+                'kind': kind,
+                'state': 'queued',
+                'submitted': time.time(),
+                'finished': None,
+                'error': None,
+                'info': {},
+                'control_dir': control_dir,
+                'call': (args, kwargs),
+            }
+            self._pending.setdefault(owner, deque()).append(job_id)
+            started = self._dispatch()
+        self._watch(started)
+        return job_id
+
+    def _dispatch(self):
+        """把等待中的任务提交到进程池，返回 [(任务 ID, future), ...]。
+
+        调用方已持有锁；返回的 future 要在释放锁之后再用 _watch 注册回调，
+        已经结束的 future 注册时会立即执行回调，而回调需要获取同一把锁。
+        """
+        started = []
+        while sum(self._running.values()) < self.max_workers:
+            owners = [owner for owner, queue in self._pending.items() if queue]
+            if not owners:
+                return started
+            owner = min(owners, key=lambda o: (self._running.get(o, 0), self._jobs[self._pending[o][0]]['submitted']))
+            job = self._jobs[self._pending[owner].popleft()]
+            args, kwargs = job.pop('call')
+            job['state'] = 'running'
+            job['started'] = time.time()
+            self._running[owner] = self._running.get(owner, 0) + 1
+            try:
+                future = self._executor.submit(_run_job, job['kind'], job['control_dir'], args, kwargs)
+            except BrokenProcessPool:
+                # 进程池已失效但失败的任务还没有回调，先换一个新的再提交
+                self._replace_executor()
+                future = self._executor.submit(_run_job, job['kind'], job['control_dir'], args, kwargs)
+            started.append((job['id'], future))
+        return started
+
+    def _watch(self, started):
+        for job_id, future in started:
+            future.add_done_callback(lambda f, job_id=job_id: self._finish(job_id, f))
+
+    def _replace_executor(self):
+        self._executor.shutdown(wait=False)
+        self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+
+    def _finish(self, job_id, future):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                self._running[job['owner']] -= 1
+                job['finished'] = time.time()
+                error = future.exception()
+                if isinstance(error, JobCancelled):
+                    job['state'] = 'cancelled'
+                elif isinstance(error, BrokenProcessPool):
+                    # 工作进程异常退出（例如内存不足被杀）后进程池不可再用，换一个新的
+                    job['state'] = 'failed'
+                    job['error'] = "工作进程异常退出，可能是内存不足，请降低 DPI 或减少页数"
+                    if getattr(self._executor, '_broken', False):
+                        self._replace_executor()
+                elif error is not None:
+                    job['state'] = 'failed'
+                    job['error'] = str(error)
+                else:
+                    job['state'] = 'done'
+                    job['info'] = future.result()
+            started = self._dispatch()
+        self._watch(started)
+
+    def cancel(self, job_id):
+        """等待中的任务直接取消；运行中的任务写入取消标记，在下一页处理前停止"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['state'] not in ACTIVE_STATES:
+                return
+            if job['state'] == 'queued':
+                self._pending[job['owner']].remove(job_id)
+                job.pop('call', None)
+                job['state'] = 'cancelled'
+                job['finished'] = time.time()
+            else:
+                open(os.path.join(job['control_dir'], "cancel"), 'w').close()
+                job['state'] = 'cancelling'
+
+    def status(self, job_id):
+        """返回任务状态的副本，包括最新进度 (done, total) 和排队位置"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            status = {key: value for key, value in job.items() if key != 'call'}
+            if job['state'] == 'queued':
+                status['queue_position'] = self._pending[job['owner']].index(job_id) + 1
+        status['done'], status['total'] = read_progress(status['control_dir'])
+        return status
+
+    def forget(self, job_id):
+        """从任务表中移除已结束的任务并删除其控制目录，输出文件由调用方管理"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job['state'] in ACTIVE_STATES:
+                return
+            del self._jobs[job_id]
+        shutil.rmtree(job['control_dir'], ignore_errors=True)
+
+    def sweep(self, ttl):
+        """移除结束超过 ttl 秒的任务"""
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, job in self._jobs.items()
+                       if job['finished'] is not None and now - job['finished'] > ttl]
+        for job_id in expired:
+            self.forget(job_id)
@@ -0,0 +1,185 @@
+import contextlib
+import io
+import os
+import time
+import zlib
+import fitz
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from PIL import Image
+from pdf_encoding import DEFAULT_PRESET, get_preset, is_grayscale, save_options
+from pdf_tool import open_pdf
+
+OPTIMIZE_DPI = 150  # 图片降采样的目标 DPI
+# 有效 DPI 超过目标的该倍数才降采样，避免为了小幅缩小而重新做有损压缩
+DOWNSAMPLE_THRESHOLD = 1.2
+# 重写时：garbage=4 合并内容相同的对象，deflate 压缩未压缩的数据流，对象流进一步减少交叉引用开销
+OPTIMIZE_SAVE_OPTIONS = {'garbage': 4, 'deflate': True, 'deflate_images': True, 'deflate_fonts': True,
+                         'use_objstms': 1}
+
+
+def _downsample_image(image_bytes, scale, encoding):
+    """在子进程中解码图片，按比例缩小后重新编码。
+
+    颜色不超过 256 种的图片（图表、线稿）用 Flate 无损压缩像素，其余编码为 JPEG，压缩参数取自编码预设。
+    返回 (数据, 过滤器, 宽, 高, 模式)。
+    """
+    preset = get_preset(encoding)
+    with Image.open(io.BytesIO(image_bytes)) as img:
+        img.load()
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        lossless = img.getcolors(256) is not None
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        img = img.resize(size, Image.Resampling.LANCZOS)
+        if preset['gray_tolerance'] is not None and is_grayscale(img, preset['gray_tolerance']):
+            img = img.convert('L')
+        if lossless:
+            return zlib.compress(img.tobytes(), preset['png_compress_level']), '/FlateDecode', *img.size, img.mode
+        buffer = io.BytesIO()
+        img.save(buffer, **save_options('jpg', preset))
+        return buffer.getvalue(), '/DCTDecode', *img.size, img.mode
+
+
+def _replace_image(doc, xref, data, filter_name, width, height, mode):
+    """原地改写图片对象，所有引用它的页面显示位置和大小不变"""
+    doc.update_stream(xref, data, compress=False)
+    doc.xref_set_key(xref, 'Filter', filter_name)
+    doc.xref_set_key(xref, 'Width', str(width))
+    doc.xref_set_key(xref, 'Height', str(height))
+    doc.xref_set_key(xref, 'BitsPerComponent', '8')
+    doc.xref_set_key(xref, 'ColorSpace', '/DeviceGray' if mode == 'L' else '/DeviceRGB')
+    # 原图的解码参数和 Decode 数组不再适用
+    doc.xref_set_key(xref, 'DecodeParms', 'null')
+    doc.xref_set_key(xref, 'Decode', 'null')
+
+
+def _image_placements(doc):
+    """统计每个图片对象在页面上的最低有效 DPI。
+
+    同一图片在多处以不同尺寸显示时按显示最大的一处计算，缩小后不会影响任何一处的清晰度。
+    带透明蒙版和 1 位的图片不处理。
+    """
+    placements = {}
+    for page in doc:
+        for xref, smask, width, height, bpc, *_ in page.get_images(full=True):
+            if smask or bpc == 1:
+                continue
+            for rect in page.get_image_rects(xref):
+                if rect.is_empty:
+                    continue
+                dpi = min(width / (rect.width / 72), height / (rect.height / 72))
+                placements[xref] = min(dpi, placements.get(xref, dpi))
+    return placements
+
+
+def optimize_pdf(input_path, output_path, dpi=OPTIMIZE_DPI, password=None, encoding=DEFAULT_PRESET, executor=None,
+                 workers=None):
+    """降采样超过目标 DPI 的图片并重写 PDF，合并重复对象、压缩数据流。
+
+    图片的解码和重新编码在进程池中进行，可以传入共享的 executor（workers 为其进程数），否则按 workers 新建。
+    只有变小的图片才会替换；加密文件保持原有的加密方式。output_path 可以与 input_path 相同。
+    返回 {'input', 'output', 'before', 'after', 'images', 'downsampled', 'seconds'}。
+    """
+    start = time.perf_counter()
+    before = os.path.getsize(input_path)
+    doc = open_pdf(input_path, password)
+    workers = workers or os.cpu_count() or 1
+    owns_executor = executor is None
+    if owns_executor:
+        executor = ProcessPoolExecutor(max_workers=workers)
+
+    tmp_path = f"{output_path}.tmp"
+    try:
+        placements = _image_placements(doc)
+        tasks = iter([(xref, dpi / effective_dpi) for xref, effective_dpi in placements.items()
+                      if effective_dpi > dpi * DOWNSAMPLE_THRESHOLD])
+        downsampled = 0
+        running = {}
+        while True:
+            # 同时在途的图片数保持在进程数的两倍以内，限制主进程中驻留的图片字节
+            for xref, scale in tasks:
+                image_bytes = doc.extract_image(xref)['image']
+                future = executor.submit(_downsample_image, image_bytes, scale, encoding)
+                running[future] = xref
+                if len(running) >= workers * 2:
+                    break
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                xref = running.pop(future)
+                try:
+                    replacement = future.result()
+                except Exception as e:
+                    # PIL 无法解码的格式（如 JBIG2）保持原样
+                    print(f"跳过图片 {xref}: {str(e)}")
+                    continue
+                # 重新编码后反而变大（例如原图已是高压缩率的 JPEG）时保留原图
+                if len(replacement[0]) < len(doc.xref_stream_raw(xref)):
+                    _replace_image(doc, xref, *replacement)
+                    downsampled += 1
+
+        # 保存默认去除加密，需显式保留原有的加密方式和密码
+        doc.save(tmp_path, encryption=fitz.PDF_ENCRYPT_KEEP, **OPTIMIZE_SAVE_OPTIONS)
+    except BaseException:
+        _remove_tmp(tmp_path)
+        raise
+    finally:
+        doc.close()
+        if owns_executor:
+            executor.shutdown()
+    # 关闭文档后再替换，输出与输入相同时也能覆盖
+    try:
+        os.replace(tmp_path, output_path)
+    except OSError:
+        _remove_tmp(tmp_path)
+        raise
+
+    return {
+        'input': input_path,
+        'output': output_path,
+        'before': before,
+        'after': os.path.getsize(output_path),
+        'images': len(placements),
+        'downsampled': downsampled,
+        'seconds': time.perf_counter() - start,
+    }
+
+
+def _remove_tmp(tmp_path):
+    """失败时删除未完成的临时文件，批量处理目录时不会每个失败的文件留下一个 .tmp"""
+    with contextlib.suppress(OSError):
+        os.remove(tmp_path)
+
+
+def format_optimize_result(result):
+    before, after = result['before'], result['after']
+    ratio = (after - before) / before * 100 if before else 0.0
+    return (f"{result['input']}: {before / 1024 ** 2:.2f} MB -> {after / 1024 ** 2:.2f} MB ({ratio:+.1f}%)，"
+            f"降采样图片 {result['downsampled']}/{result['images']}，耗时 {result['seconds']:.2f} 秒")
+
+
+def optimize_pdfs(tasks, dpi=OPTIMIZE_DPI, password=None, encoding=DEFAULT_PRESET, workers=None):
+    """依次优化 [(输入路径, 输出路径), ...]，所有文档共用一个图片处理进程池，打印每个文档和总计的结果"""
+    workers = workers or os.cpu_count() or 1
+    results = []
+    failed = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for input_path, output_path in tasks:
+            os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+            try:
+                result = optimize_pdf(input_path, output_path, dpi, password, encoding, executor, workers)
+            except Exception as e:
+                print(f"{input_path}: 优化失败: {str(e)}")
+                failed += 1
+                continue
+            results.append(result)
+            print(format_optimize_result(result))
+
+    if len(tasks) > 1:
+        before = sum(result['before'] for result in results)
+        after = sum(result['after'] for result in results)
+        print(f"\n优化完成: 成功 {len(results)} 个, 失败 {failed} 个, "
+              f"{before / 1024 ** 2:.2f} MB -> {after / 1024 ** 2:.2f} MB, 耗时 {time.perf_counter() - start:.2f} 秒")
+    return results
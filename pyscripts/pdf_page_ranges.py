@@ -0,0 +1,147 @@
+import bisect
+import heapq
+import re
+
+# 单个范围的写法：
+#   7        单页
+#   3-9      第 3 到第 9 页
+#   10-      第 10 页到最后一页
+#   -5       最后 5 页
+#   1-100:2  任意范围后加 :步长，例如奇数页
+#   只允许在 - 和 : 两侧加空格，'1 3' 这样缺少分隔符的写法会报错
+_RANGE_PATTERN = re.compile(r'^(?P<start>\d+)?(?:\s*(?P<dash>-)\s*(?P<end>\d+)?)?\s*(?::\s*(?P<step>\d+))?$')
+
+
+class PageRanges:
+    """编译后的页面范围：按页码升序、去重，只保存区间，不展开页码。
+
+    可以像页码列表一样迭代、取 len 和判断 in；intervals() 产出连续区间，供渲染器整段调用后端。
+    """
+
+    def __init__(self, progressions, total_pages):
+        self.total_pages = total_pages
+        # 步长为 1 的范围合并为互不重叠的区间，带步长的范围单独保存
+        merged = []
+        for r in sorted((r for r in progressions if r.step == 1), key=lambda r: r.start):
+            if merged and r.start <= merged[-1].stop:
+                if r.stop > merged[-1].stop:
+                    merged[-1] = range(merged[-1].start, r.stop)
+            else:
+                merged.append(r)
+        starts = [r.start for r in merged]
+        stepped = []
+        for r in progressions:
+            if r.step == 1:
+                continue
+            index = bisect.bisect_right(starts, r.start) - 1
+            if index >= 0 and r[-1] < merged[index].stop:
+                continue  # 已被某个连续区间完全覆盖
+            stepped.append(r)
+        self.progressions = sorted(merged + stepped, key=lambda r: (r.start, r[-1]))
+        # 各段首尾不重叠时可以直接依次迭代，否则需要多路归并去重
+        self._disjoint = all(a[-1] < b.start for a, b in zip(self.progressions, self.progressions[1:]))
+        self._length = sum(len(r) for r in self.progressions) if self._disjoint else None
+
+    def __iter__(self):
+        if self._disjoint:
+            for r in self.progressions:
+                yield from r
+            return
+        last = 0
+        for page in heapq.merge(*self.progressions):
+            if page != last:
+                yield page
+                last = page
+
+    def __len__(self):
+        if self._length is None:
+            self._length = sum(1 for _ in self)
+        return self._length
+
+    def __bool__(self):
+        return bool(self.progressions)
+
+    def __contains__(self, page):
+        return any(page in r for r in self.progressions)
+
+    def __repr__(self):
+        return f"PageRanges('{format_page_ranges(self)}', total_pages={self.total_pages})"
+
+    def intervals(self):
+        """按顺序产出连续页面区间 (起始页, 结束页)"""
+        if all(r.step == 1 for r in self.progressions):
+            return ((r.start, r.stop - 1) for r in self.progressions)
+        return _group_pages(self)
+
+
+def parse_page_ranges(page_range, total_pages):
+    """把页面范围字符串（如 '1,3-5,10-,-2,1-9:2'）编译为 PageRanges，留空表示全部页面。
+
+    范围内部和逗号两侧的空白会被忽略；页码为 0、起始页大于结束页、超出文档页数或写法无法识别时抛出 ValueError。
+    """
+    if not page_range or not page_range.strip():
+        return PageRanges([range(1, total_pages + 1)] if total_pages else [], total_pages)
+
+    progressions = []
+    for part in page_range.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        match = _RANGE_PATTERN.match(part)
+        if not match or not (match['start'] or match['end']):
+            raise ValueError(f"无法识别的页面范围: '{part}'")
+        start = int(match['start']) if match['start'] else None
+        end = int(match['end']) if match['end'] else None
+        step = int(match['step']) if match['step'] else 1
+
+        if not match['dash']:
+            if match['step']:
+                raise ValueError(f"单个页码不能指定步长: '{part}'")
+            end = start
+        elif start is None:
+            # -N 表示最后 N 页
+            if end == 0:
+                raise ValueError(f"页面范围不能为空: '{part}'")
+            start, end = max(1, total_pages - end + 1), total_pages
+        elif end is None:
+            end = total_pages
+
+        if step == 0:
+            raise ValueError(f"步长必须大于 0: '{part}'")
+        if start == 0 or end == 0:
+            raise ValueError(f"页码从 1 开始: '{part}'")
+        if start > end:
+            if start > total_pages:
+                raise ValueError(f"页码 {start} 超出范围 (1-{total_pages}): '{part}'")
+            raise ValueError(f"起始页大于结束页: '{part}'")
+        if end > total_pages:
+            raise ValueError(f"页码 {end} 超出范围 (1-{total_pages}): '{part}'")
+        progressions.append(range(start, end + 1, step))
+    return PageRanges(progressions, total_pages)
+
+
+def _group_pages(pages):
+    start = end = None
+    for page in pages:
+        if end is not None and page == end + 1:
+            end = page
+            continue
+        if end is not None:
+            yield start, end
+        start = end = page
+    if end is not None:
+        yield start, end
+
+
+def group_contiguous_pages(pages):
+    """把有序页码分组为连续区间，例如 [1, 2, 3, 7] -> (1, 3), (7, 7)，逐个产出"""
+    if isinstance(pages, PageRanges):
+        return pages.intervals()
+    return _group_pages(pages)
+
+
+def format_page_ranges(pages):
+    """把页码集合压缩为页面范围字符串，例如 [1, 2, 3, 7] -> '1-3,7'，可直接交给 parse_page_ranges"""
+    if not isinstance(pages, PageRanges):
+        pages = sorted(set(pages))
+    return ','.join(str(start) if start == end else f"{start}-{end}" for start, end in group_contiguous_pages(pages))
@@ -1,61 +1,55 @@
 import argparse
 import os
+import tempfile
 from pdf2image import convert_from_path
 from PIL import Image
 from PyPDF2 import PdfReader, PdfWriter
+from pdf_encoding import DEFAULT_PRESET, ENCODING_PRESETS, save_page_image
+from pdf_page_ranges import group_contiguous_pages, parse_page_ranges
 
+# 每次调用 poppler 最多渲染的页数，限制同时落盘/驻留的页面数量
+RENDER_BATCH_SIZE = 10
 
-def try_remove_pdf_password(input_path, password=None):
-    with open(input_path, 'rb') as file:
-        pdf_reader = PdfReader(file)
 
-        if pdf_reader.is_encrypted:
-            if password is None:
-                # 尝试无密码解密
-                if pdf_reader.decrypt(''):
-                    print("PDF文件已成功解密（无需密码）")
-                    return input_path
-                else:
-                    raise ValueError("PDF文件已加密，需要密码")
-            else:
-                if pdf_reader.decrypt(password):
-                    pdf_writer = PdfWriter()
-                    for page in pdf_reader.pages:
-                        pdf_writer.add_page(page)
-
-                    output_path = input_path.replace('.pdf', '_decrypted.pdf')
-                    with open(output_path, 'wb') as output_file:
-                        pdf_writer.write(output_file)
-
-                    print(f"已解密的PDF保存到: {output_path}")
-                    return output_path
-                else:
-                    raise ValueError("提供的密码不正确")
-        else:
-            print("PDF文件未加密")
-            return input_path
-
-
-def parse_page_ranges(page_range_str, total_pages):
-    pages = set()
-    ranges = page_range_str.split(',')
-    for r in ranges:
-        if '-' in r:
-            start, end = map(int, r.split('-'))
-            pages.update(range(start, min(end + 1, total_pages + 1)))
-        else:
-            page = int(r)
-            if 1 <= page <= total_pages:
-                pages.add(page)
-    return sorted(list(pages))
-
-
-def process_pdf(pdf_path, page_range_str, output_path, dpi=300, split_pages=False):
+def open_pdf_reader(pdf_path, password=None):
+    """打开 PDF 并在内存中解密，不生成解密后的临时文件"""
     try:
         pdf_reader = PdfReader(pdf_path)
-        total_pages = len(pdf_reader.pages)
     except Exception as e:
-        raise ValueError(f"无法读取PDF文件: {str(e)}。请确保poppler已安装并配置好。")
+        raise ValueError(f"无法读取PDF文件: {str(e)}")
+
+    if pdf_reader.is_encrypted:
+        if password is None:
+            # 尝试无密码解密
+            if not pdf_reader.decrypt(''):
+                raise ValueError("PDF文件已加密，需要密码")
+        elif not pdf_reader.decrypt(password):
+            raise ValueError("提供的密码不正确")
+    return pdf_reader
+
+
+def iter_rendered_pages(pdf_path, pages, dpi, spool_dir, batch_size=RENDER_BATCH_SIZE, password=None):
+    """按连续区间分批调用 poppler，只渲染需要的页面。
+
+    poppler 直接把每页写入 spool_dir，这里只返回 (页码, 文件路径)，
+    调用方用完后应删除对应文件，内存中不保留整批图像。
+    """
+    for start, end in group_contiguous_pages(pages):
+        for batch_start in range(start, end + 1, batch_size):
+            batch_end = min(batch_start + batch_size - 1, end)
+            try:
+                paths = convert_from_path(pdf_path, dpi=dpi, first_page=batch_start, last_page=batch_end,
+                                          output_folder=spool_dir, paths_only=True, userpw=password)
+            except Exception as e:
+                raise ValueError(f"无法转换PDF页面为图像: {str(e)}。请确保poppler已安装并配置好。")
+            for page_num, path in zip(range(batch_start, batch_end + 1), paths):
+                yield page_num, path
+
+
+def process_pdf(pdf_path, page_range_str, output_path, dpi=300, split_pages=False, password=None,
+                encoding=DEFAULT_PRESET):
+    pdf_reader = open_pdf_reader(pdf_path, password)
+    total_pages = len(pdf_reader.pages)
 
     pages_to_process = parse_page_ranges(page_range_str, total_pages)
 
@@ -63,44 +57,42 @@ def process_pdf(pdf_path, page_range_str, output_path, dpi=300, split_pages=Fals
     output_format = file_extension[1:].lower()
 
     if output_format in ['jpg', 'jpeg', 'png']:
-        try:
-            all_images = convert_from_path(pdf_path, dpi=dpi)
-        except Exception as e:
-            raise ValueError(f"无法转换PDF页面为图像: {str(e)}。请确保poppler已安装并配置好。")
-
-        if split_pages:
-            base_name, ext = os.path.splitext(output_path)
-            for i, page_num in enumerate(pages_to_process):
-                img = all_images[page_num - 1]
-                page_output_path = f"{base_name}_{page_num}{ext}"
-                if output_format in ['jpg', 'jpeg']:
-                    img.save(page_output_path, format='JPEG', quality=85, optimize=True)
-                else:  # png
-                    img.save(page_output_path, format='PNG', optimize=True)
-                print(f"输出文件已保存到: {page_output_path}")
-        else:
-            images = [all_images[i - 1] for i in pages_to_process]
-
-            if len(images) == 1:
-                if output_format in ['jpg', 'jpeg']:
-                    images[0].save(output_path, format='JPEG', quality=85, optimize=True)
-                else:  # png
-                    images[0].save(output_path, format='PNG', optimize=True)
+        with tempfile.TemporaryDirectory() as spool_dir:
+            if split_pages:
+                base_name, ext = os.path.splitext(output_path)
+                for page_num, page_path in iter_rendered_pages(pdf_path, pages_to_process, dpi, spool_dir,
+                                                               password=password):
+                    page_output_path = f"{base_name}_{page_num}{ext}"
+                    with Image.open(page_path) as img:
+                        save_page_image(img, page_output_path, encoding)
+                    os.remove(page_path)
+                    print(f"输出文件已保存到: {page_output_path}")
             else:
-                total_height = sum(img.height for img in images)
-                max_width = max(img.width for img in images)
+                # 先把页面逐批渲染到磁盘，再逐页读入拼接，内存中最多只有长图和一页图像
+                page_paths = [path for _, path in iter_rendered_pages(pdf_path, pages_to_process, dpi, spool_dir,
+                                                                      password=password)]
+
+                if len(page_paths) == 1:
+                    with Image.open(page_paths[0]) as img:
+                        save_page_image(img, output_path, encoding)
+                else:
+                    sizes = []
+                    for path in page_paths:
+                        with Image.open(path) as img:
+                            sizes.append(img.size)
+                    total_height = sum(height for _, height in sizes)
+                    max_width = max(width for width, _ in sizes)
 
-                long_image = Image.new('RGB', (max_width, total_height), (255, 255, 255))
+                    long_image = Image.new('RGB', (max_width, total_height), (255, 255, 255))
 
-                y_offset = 0
-                for img in images:
-                    long_image.paste(img, (0, y_offset))
-                    y_offset += img.height
+                    y_offset = 0
+                    for path in page_paths:
+                        with Image.open(path) as img:
+                            long_image.paste(img, (0, y_offset))
+                            y_offset += img.height
+                        os.remove(path)
 
-                if output_format in ['jpg', 'jpeg']:
-                    long_image.save(output_path, format='JPEG', quality=85, optimize=True)
-                else:  # png
-                    long_image.save(output_path, format='PNG', optimize=True)
+                    save_page_image(long_image, output_path, encoding)
 
     elif output_format == 'pdf':
         pdf_writer = PdfWriter()
@@ -143,6 +135,8 @@ def main():
     process_parser.add_argument("-d", "--dpi", type=int, default=300, help="图像DPI (仅用于jpg和png输出，默认: 300)")
     process_parser.add_argument("-p", "--password", help="PDF密码（如果PDF加密）")
     process_parser.add_argument("-s", "--split-pages", action='store_true', help="按每页生成单独的JPG或PNG文件")
+    process_parser.add_argument("-e", "--encoding", default=DEFAULT_PRESET, choices=list(ENCODING_PRESETS),
+                                help=f"图片编码预设：fast 最快，balanced 兼顾，smallest 最小 (默认: {DEFAULT_PRESET})")
 
     # 合并PDF的命令
     merge_parser = subparsers.add_parser('merge', help='合并多个PDF文件')
@@ -153,16 +147,14 @@ def main():
 
     if args.command == 'process':
         try:
-            decrypted_pdf_path = try_remove_pdf_password(args.input_pdf, args.password)
-            process_pdf(decrypted_pdf_path, args.page_range, args.output, args.dpi, args.split_pages)
-            if decrypted_pdf_path != args.input_pdf:
-                os.remove(decrypted_pdf_path)
+            process_pdf(args.input_pdf, args.page_range, args.output, args.dpi, args.split_pages, args.password,
+                        args.encoding)
         except ValueError as e:
             if "PDF文件已加密，需要密码" in str(e):
                 password = input("请输入PDF密码: ")
                 try:
-                    decrypted_pdf_path = try_remove_pdf_password(args.input_pdf, password)
-                    process_pdf(decrypted_pdf_path, args.page_range, args.output, args.dpi, args.split_pages)
+                    process_pdf(args.input_pdf, args.page_range, args.output, args.dpi, args.split_pages, password,
+                                args.encoding)
                 except ValueError as e:
                     print(f"处理过程中出错: {str(e)}")
             else:
@@ -0,0 +1,105 @@
+import contextlib
+import json
+import sys
+import time
+import unicodedata
+
+try:
+    import resource
+except ImportError:  # Windows 没有 resource 模块
+    resource = None
+
+
+def peak_rss_mb(children=False):
+    """当前进程（children=True 时为已结束的子进程中最大者）的峰值常驻内存，单位 MB；无法获取时返回 None。
+
+    Windows 下需要安装 psutil，且不统计子进程。
+    """
+    if resource is not None:
+        who = resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF
+        # Linux 下 ru_maxrss 单位为 KB，macOS 下为字节
+        scale = 1024 ** 2 if sys.platform == 'darwin' else 1024
+        return resource.getrusage(who).ru_maxrss / scale
+    if children:
+        return None
+    try:
+        import psutil
+    except ImportError:
+        return None
+    memory = psutil.Process().memory_info()
+    return getattr(memory, 'peak_wset', memory.rss) / 1024 ** 2
+
+
+def _round(value, digits=1):
+    return round(value, digits) if value is not None else None
+
+
+class StageProfiler:
+    """按阶段累计耗时和次数，并记录每个阶段结束时的进程峰值内存。
+
+    同一阶段可以多次进入（例如每页一次渲染），耗时累加；阶段之间不应嵌套，否则外层会包含内层的耗时。
+    """
+
+    def __init__(self, command, target=None):
+        self.command = command
+        self.target = target
+        self.stages = {}
+        self._start = time.perf_counter()
+        # ru_maxrss 是历史最大值，此前结束的子进程（如检测外部命令）不应计入本次运行
+        self._children_baseline = peak_rss_mb(children=True)
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record = self.stages.setdefault(name, {'calls': 0, 'seconds': 0.0, 'peak_rss_mb': None})
+            record['calls'] += 1
+            record['seconds'] += time.perf_counter() - start
+            peak = peak_rss_mb()
+            if peak is not None:
+                record['peak_rss_mb'] = max(record['peak_rss_mb'] or 0.0, peak)
+
+    def records(self):
+        """各阶段记录加一条 total 记录；total 的峰值内存同时统计多进程渲染等子进程，无法获取的内存值为 None"""
+        children_peak = peak_rss_mb(children=True)
+        records = [{'command': self.command, 'target': self.target, 'stage': name, 'calls': record['calls'],
+                    'seconds': round(record['seconds'], 4), 'peak_rss_mb': _round(record['peak_rss_mb'])}
+                   for name, record in self.stages.items()]
+        records.append({'command': self.command, 'target': self.target, 'stage': 'total', 'calls': 1,
+                        'seconds': round(time.perf_counter() - self._start, 4),
+                        'peak_rss_mb': _round(peak_rss_mb()),
+                        'children_peak_rss_mb': _round(children_peak)
+                        if children_peak is not None and children_peak > self._children_baseline else None})
+        return records
+
+    def write_log(self, log_path):
+        """以 JSON Lines 格式追加本次运行的各阶段记录，多次运行的结果可以汇总比较"""
+        timestamp = time.strftime('%Y-%m-%dT%H:%M:%S')
+        with open(log_path, 'a', encoding='utf-8') as f:
+            for record in self.records():
+                f.write(json.dumps({'time': timestamp, **record}, ensure_ascii=False) + '\n')
+
+    def print_table(self):
+        records = self.records()
+        total_seconds = records[-1]['seconds'] or 1
+        print('\n' + _pad('阶段', -14) + _pad('次数', 8) + _pad('耗时(秒)', 12) + _pad('占比', 10)
+              + _pad('峰值内存(MB)', 14))
+        for record in records:
+            share = record['seconds'] / total_seconds * 100
+            peak = f"{record['peak_rss_mb']:.1f}" if record['peak_rss_mb'] is not None else '-'
+            print(f"{record['stage']:<14}{record['calls']:>8}{record['seconds']:>12.3f}{share:>9.1f}%{peak:>14}")
+        if records[-1]['children_peak_rss_mb']:
+            print(f"子进程峰值内存: {records[-1]['children_peak_rss_mb']:.1f} MB")
+
+
+def _pad(text, width):
+    """按显示宽度补齐空格，中文字符占两列；width 为负数时左对齐"""
+    padding = ' ' * max(0, abs(width) - sum(2 if unicodedata.east_asian_width(c) in 'WF' else 1 for c in text))
+    return text + padding if width < 0 else padding + text
+
+
+def stage(profiler, name):
+    """profiler 为 None 时不做任何记录，便于在函数中统一写 with stage(profiler, ...)"""
+    return profiler.stage(name) if profiler is not None else contextlib.nullcontext()
@@ -0,0 +1,197 @@
+import os
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pdf_page_ranges import format_page_ranges
+from pdf_tool import open_pdf
+
+TEXT_INDEX_FILENAME = "pdf_text_index.db"  # 对目录建立索引时默认的索引文件名
+TEXT_CHUNK_PAGES = 200  # 每个提取任务处理的页数，大文档拆成多个任务并行提取
+# trigram 分词器按三个字符切分，中英文都能做子串匹配；少于三个字符的词无法走索引
+MIN_MATCH_TERM_LENGTH = 3
+SNIPPET_CHARS = 40
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    pages INTEGER NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS page_text USING fts5(text, doc_id UNINDEXED, page UNINDEXED, tokenize='trigram');
+"""
+
+
+def open_index(index_path):
+    conn = sqlite3.connect(index_path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def _extract_text_worker(pdf_path, password, first_page, last_page):
+    """在子进程中提取一段页面的文本，返回 [(页码, 文本), ...]"""
+    doc = open_pdf(pdf_path, password)
+    try:
+        return [(page_num, doc[page_num - 1].get_text()) for page_num in range(first_page, last_page + 1)]
+    finally:
+        doc.close()
+
+
+def _page_count(pdf_path, password):
+    doc = open_pdf(pdf_path, password)
+    try:
+        return len(doc)
+    finally:
+        doc.close()
+
+
+def build_text_index(pdf_paths, index_path, password=None, workers=None, rebuild=False):
+    """提取每个 PDF 每页的文本写入 SQLite FTS5 索引。
+
+    文件大小和修改时间未变的文档跳过；已不在 pdf_paths 中的文档从索引中删除。
+    文本提取在进程池中按页段并行进行，所有写入都在主进程中完成。
+    """
+    workers = workers or os.cpu_count() or 1
+    pdf_paths = [os.path.abspath(path) for path in pdf_paths]
+    conn = open_index(index_path)
+    start = time.perf_counter()
+
+    if rebuild:
+        conn.execute("DELETE FROM page_text")
+        conn.execute("DELETE FROM documents")
+    indexed = {path: (doc_id, size, mtime)
+               for doc_id, path, size, mtime in conn.execute("SELECT id, path, size, mtime FROM documents")}
+
+    wanted = set(pdf_paths)
+    for path, (doc_id, _, _) in indexed.items():
+        if path not in wanted:
+            conn.execute("DELETE FROM page_text WHERE doc_id = ?", (doc_id,))
+            conn.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+            print(f"已从索引中移除: {path}")
+
+    to_index = []
+    for path in pdf_paths:
+        stat = os.stat(path)
+        known = indexed.get(path)
+        if known and known[1] == stat.st_size and known[2] == stat.st_mtime:
+            continue
+        to_index.append((path, stat.st_size, stat.st_mtime))
+    conn.commit()
+    print(f"共 {len(pdf_paths)} 个文件，需要建立索引 {len(to_index)} 个")
+
+    # 先读页数并把文档拆成页段任务
+    tasks = []
+    documents = {}
+    for path, size, mtime in to_index:
+        try:
+            pages = _page_count(path, password)
+        except Exception as e:
+            print(f"跳过 {path}: {str(e)}")
+            continue
+        documents[path] = {'size': size, 'mtime': mtime, 'pages': pages, 'remaining': 0, 'texts': []}
+        for first_page in range(1, pages + 1, TEXT_CHUNK_PAGES):
+            tasks.append((path, first_page, min(first_page + TEXT_CHUNK_PAGES - 1, pages)))
+            documents[path]['remaining'] += 1
+        if pages == 0:
+            _write_document(conn, path, documents.pop(path))
+
+    total_pages = 0
+    task_iter = iter(tasks)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        for path, first_page, last_page in task_iter:
+            pending[executor.submit(_extract_text_worker, path, password, first_page, last_page)] = path
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = pending.pop(future)
+                document = documents.get(path)
+                try:
+                    texts = future.result()
+                except Exception as e:
+                    if document is not None:
+                        print(f"跳过 {path}: {str(e)}")
+                        documents.pop(path)
+                    continue
+                if document is None:
+                    continue
+                document['texts'].extend(texts)
+                document['remaining'] -= 1
+                if document['remaining'] == 0:
+                    total_pages += _write_document(conn, path, documents.pop(path))
+                    print(f"已建立索引: {path}")
+            for path, first_page, last_page in task_iter:
+                pending[executor.submit(_extract_text_worker, path, password, first_page, last_page)] = path
+                if len(pending) >= workers * 2:
+                    break
+
+    conn.execute("INSERT INTO page_text(page_text) VALUES ('optimize')")
+    conn.commit()
+    conn.close()
+    elapsed = time.perf_counter() - start
+    print(f"索引完成: {total_pages} 页，耗时 {elapsed:.2f} 秒，索引文件: {index_path}")
+
+
+def _write_document(conn, path, document):
+    """用新的页面文本替换该文档在索引中的记录，返回写入的页数"""
+    row = conn.execute("SELECT id FROM documents WHERE path = ?", (path,)).fetchone()
+    if row:
+        conn.execute("DELETE FROM page_text WHERE doc_id = ?", (row[0],))
+        conn.execute("DELETE FROM documents WHERE id = ?", (row[0],))
+    cursor = conn.execute("INSERT INTO documents (path, size, mtime, pages, indexed_at) VALUES (?, ?, ?, ?, ?)",
+                          (path, document['size'], document['mtime'], document['pages'], time.time()))
+    doc_id = cursor.lastrowid
+    conn.executemany("INSERT INTO page_text (text, doc_id, page) VALUES (?, ?, ?)",
+                     ((text, doc_id, page_num) for page_num, text in sorted(document['texts'])))
+    conn.commit()
+    return len(document['texts'])
+
+
+def _make_snippet(text, term):
+    position = text.lower().find(term.lower())
+    if position < 0:
+        return text[:SNIPPET_CHARS * 2]
+    start = max(0, position - SNIPPET_CHARS)
+    end = position + len(term) + SNIPPET_CHARS
+    snippet = text[start:position] + '[' + text[position:position + len(term)] + ']' + text[position + len(term):end]
+    return ('…' if start else '') + snippet + ('…' if end < len(text) else '')
+
+
+def search_index(index_path, query, limit=50):
+    """按空格分隔的关键词（全部包含）搜索，返回 [{'path', 'page', 'snippet'}, ...]，按相关度排序"""
+    terms = query.split()
+    if not terms:
+        raise ValueError("搜索内容不能为空")
+    if not os.path.exists(index_path):
+        raise ValueError(f"索引文件不存在: {index_path}")
+
+    conn = sqlite3.connect(index_path)
+    try:
+        if all(len(term) >= MIN_MATCH_TERM_LENGTH for term in terms):
+            # 每个词加引号作为短语，避免用户输入中的 FTS5 语法字符
+            match = ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+            rows = conn.execute(
+                "SELECT d.path, p.page, snippet(page_text, 0, '[', ']', '…', 64) FROM page_text p "
+                "JOIN documents d ON d.id = p.doc_id WHERE page_text MATCH ? ORDER BY rank LIMIT ?",
+                (match, limit)).fetchall()
+        else:
+            # 过短的词无法使用 trigram 索引，逐页扫描
+            conditions = ' AND '.join("instr(lower(p.text), lower(?)) > 0" for _ in terms)
+            rows = [(path, page, _make_snippet(text, terms[0])) for path, page, text in conn.execute(
+                f"SELECT d.path, p.page, p.text FROM page_text p JOIN documents d ON d.id = p.doc_id "
+                f"WHERE {conditions} ORDER BY d.path, p.page LIMIT ?", (*terms, limit))]
+    finally:
+        conn.close()
+    return [{'path': path, 'page': page, 'snippet': snippet.replace('\n', ' ').strip()} for path, page, snippet in rows]
+
+
+def hits_to_page_ranges(hits):
+    """把命中结果按文档汇总为页面范围字符串，可直接作为 process 的 page_range 参数"""
+    pages = {}
+    for hit in hits:
+        pages.setdefault(hit['path'], set()).add(hit['page'])
+    return {path: format_page_ranges(doc_pages) for path, doc_pages in pages.items()}
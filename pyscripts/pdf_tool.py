@@ -1,54 +1,590 @@
 import argparse
+import collections
+import contextlib
+import csv
+import glob
+import hashlib
+import itertools
+import json
+import math
 import os
+import shutil
+import struct
+import tempfile
+import time
+import zlib
 import fitz  # PyMuPDF
 import io
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from PIL import Image
+from pdf_backends import BACKENDS, get_backend, select_backend
+from pdf_encoding import (DEFAULT_PRESET, ENCODING_PRESETS, EncodeStats, encode_page_image, get_preset,
+                          save_page_image)
+from pdf_page_ranges import group_contiguous_pages, parse_page_ranges
+from pdf_profile import StageProfiler, stage
 
-def try_remove_pdf_password(input_path, password=None):
-    doc = fitz.open(input_path)
+LONG_IMAGE_MAX_HEIGHT = 65000  # PIL的最大支持高度
+DEFAULT_CACHE_SIZE = 2 * 1024 ** 3  # 页面缓存默认上限 2GB
+IMAGE_INDEX_FILENAME = "images_index.json"  # 提取图片时记录页面与图片文件的对应关系
+IMAGE_WRITE_WORKERS = 8  # 提取图片时并行写文件的线程数
+MERGE_CHUNK_SIZE = 50  # 合并时每次增量保存前追加的文件数
+SPOOL_CHUNK_PAGES = 4  # 多进程拼接长图时每块的页数，临时 PPM 文件最多为进程数的 8 倍页
+THUMBNAIL_DPI = 36  # 预览缩略图的 DPI
+THUMBNAIL_INDEX_FILENAME = "thumbnails.json"  # 缩略图目录生成完成的标记，记录页数和 DPI
+# MuPDF 从内存打开超过 2 GB 的文件时会崩溃（PyMuPDF 1.28 实测），更大的文件只能按路径打开
+MEMORY_STREAM_MAX_BYTES = 2 ** 31 - 1
+
+def _open_document(source):
+    """打开 PDF 但不认证，尽量避免把文件内容复制到进程内存：
+
+    路径由 MuPDF 按需读取；BytesIO 及其子类（如 Streamlit 的上传文件）取 getbuffer() 视图；
+    open() 得到的二进制文件对象按其路径打开；bytes/memoryview 直接使用；管道等其他流才整体读入。
+    """
+    if hasattr(source, 'getbuffer'):
+        # 上传文件的 name 是客户端的文件名，不能当作本地路径
+        source = source.getbuffer()
+    elif isinstance(source, (io.FileIO, io.BufferedReader, io.BufferedRandom)) and \
+            isinstance(getattr(source, 'name', None), str) and os.path.isfile(source.name):
+        return fitz.open(source.name)
+    elif hasattr(source, 'read'):
+        source = source.read()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        if len(source) > MEMORY_STREAM_MAX_BYTES:
+            raise ValueError("超过 2 GB 的PDF请通过文件路径打开")
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+
+def open_pdf(source, password=None, profiler=None):
+    """打开并在内存中认证 PDF，返回可直接使用的文档对象，不生成解密后的临时文件。
+
+    source 可以是文件路径、PDF 内容（bytes/memoryview）、文件对象或已打开的文档；已打开的文档原样返回。
+    提供 profiler（见 pdf_profile）时分别记录 open 和 authenticate 阶段。
+    """
+    if isinstance(source, fitz.Document):
+        return source
+
+    with stage(profiler, 'open'):
+        doc = _open_document(source)
     if doc.is_encrypted:
-        if password is None:
-            # 尝试无密码解密
-            if doc.authenticate(""):
-                print("PDF文件已成功解密（无需密码）")
-                return input_path
-            else:
-                raise ValueError("PDF文件已加密，需要密码")
-        else:
-            if doc.authenticate(password):
-                output_path = input_path.replace('.pdf', '_decrypted.pdf')
-                doc.save(output_path)
-                print(f"已解密的PDF保存到: {output_path}")
-                return output_path
-            else:
+        with stage(profiler, 'authenticate'):
+            if password is None:
+                # 尝试无密码解密
+                if not doc.authenticate(""):
+                    doc.close()
+                    raise ValueError("PDF文件已加密，需要密码")
+            elif not doc.authenticate(password):
+                doc.close()
                 raise ValueError("提供的密码不正确")
+    return doc
+
+
+def is_encrypted_pdf(doc):
+    # 认证成功后 is_encrypted 会变为 False，metadata 中的加密信息仍然保留
+    return doc.is_encrypted or bool((doc.metadata or {}).get('encryption'))
+
+
+class PageCache:
+    """磁盘页面位图缓存。
+
+    以 (文档 SHA-256, 页码, DPI, alpha, 色彩空间) 为键保存渲染后的原始像素，
+    总大小超过上限时淘汰最久未使用的条目。加密文档不写入缓存，避免解密后的内容落盘。
+    """
+
+    HEADER = struct.Struct('<4sIIB?')
+    MAGIC = b'PGC1'
+    COLORSPACES = {'DeviceRGB': fitz.csRGB, 'DeviceGray': fitz.csGRAY, 'DeviceCMYK': fitz.csCMYK}
+
+    def __init__(self, cache_dir, max_bytes=DEFAULT_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._total_bytes = None
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def hash_file(path):
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(block)
+        return sha256.hexdigest()
+
+    def _entry_path(self, key):
+        name = hashlib.sha256(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, f"{name}.raw")
+
+    def get(self, key):
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # 更新修改时间，作为 LRU 的访问时间
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+
+        try:
+            magic, width, height, colorspace_index, alpha = self.HEADER.unpack_from(data)
+            if magic != self.MAGIC:
+                raise ValueError("不是页面缓存文件")
+            colorspace = list(self.COLORSPACES.values())[colorspace_index]
+            samples = zlib.decompress(data[self.HEADER.size:])
+            pix = fitz.Pixmap(colorspace, width, height, samples, alpha)
+        except (struct.error, zlib.error, IndexError, ValueError, RuntimeError):
+            # 写入不完整或已损坏（如磁盘写满）的条目删除后按未命中处理，重新渲染
+            self._remove_entry(path, len(data))
+            self.misses += 1
+            return None
+        self.hits += 1
+        return pix
+
+    def _remove_entry(self, path, size):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        if self._total_bytes is not None:
+            self._total_bytes -= size
+
+    def put(self, key, pix):
+        names = list(self.COLORSPACES)
+        if pix.colorspace is None or pix.colorspace.name not in names:
+            return
+        header = self.HEADER.pack(self.MAGIC, pix.width, pix.height, names.index(pix.colorspace.name), bool(pix.alpha))
+        data = header + zlib.compress(pix.samples, 1)
+
+        path = self._entry_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        if self._total_bytes is None:
+            self._total_bytes = sum(size for _, size, _ in self._entries())
+        else:
+            self._total_bytes += len(data)
+        if self._total_bytes > self.max_bytes:
+            self._evict()
+
+    def _entries(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.raw'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.evictions += 1
+            except OSError:
+                pass
+            total -= size
+        self._total_bytes = total
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+def render_page(page, mat, dpi, cache=None, doc_hash=None, alpha=False, colorspace=fitz.csRGB):
+    """渲染单页为 pixmap，提供缓存时优先从缓存读取"""
+    if cache is None or doc_hash is None:
+        return page.get_pixmap(matrix=mat, alpha=alpha, colorspace=colorspace)
+
+    key = (doc_hash, page.number, dpi, alpha, colorspace.name)
+    pix = cache.get(key)
+    if pix is None:
+        pix = page.get_pixmap(matrix=mat, alpha=alpha, colorspace=colorspace)
+        cache.put(key, pix)
+    return pix
+
+
+def pixmap_to_image(pix):
+    """直接包装 pixmap 的原始像素缓冲区生成 PIL 图像，省去 PNG 编码再解码的过程。
+
+    图像与 pixmap 共用内存，使用图像期间必须保持 pix 存活。
+    """
+    if pix.alpha:
+        mode = "RGBA"
+    elif pix.n == 1:
+        mode = "L"
     else:
-        print("PDF文件未加密")
-        return input_path
+        mode = "RGB"
+    return Image.frombuffer(mode, (pix.width, pix.height), pix.samples_mv, "raw", mode, pix.stride, 1)
+
 
+def _render_pages_worker(input_path, password, intervals, dpi, base_name, ext, cache_config=None,
+                         encoding=DEFAULT_PRESET):
+    """在子进程中独立打开文档，渲染并保存一组连续区间 [(起始页, 结束页), ...] 内的页面，
+    只把输出路径、缓存命中和编码统计返回给主进程"""
+    doc = open_pdf(input_path, password)
 
-def parse_page_ranges(page_range, total_pages):
-    if not page_range:
-        return list(range(1, total_pages + 1))  # 如果没有指定页码，返回所有页面
+    cache, doc_hash = None, None
+    if cache_config:
+        cache_dir, max_bytes, doc_hash = cache_config
+        cache = PageCache(cache_dir, max_bytes)
 
-    pages = set()
-    ranges = page_range.split(',')
-    for r in ranges:
-        if '-' in r:
-            start, end = map(int, r.split('-'))
-            pages.update(range(start, min(end + 1, total_pages + 1)))
+    zoom = dpi / 72
+    mat = fitz.Matrix(zoom, zoom)
+    paths = []
+    encode_stats = EncodeStats(encoding)
+    for page_num in (page for start, end in intervals for page in range(start, end + 1)):
+        pix = render_page(doc[page_num - 1], mat, dpi, cache, doc_hash)
+        page_output_path = f"{base_name}_{page_num}{ext}"
+        if ext == '.ppm':
+            pix.save(page_output_path)
         else:
-            page = int(r)
-            if 1 <= page <= total_pages:
-                pages.add(page)
-    return sorted(list(pages))
+            save_page_image(pixmap_to_image(pix), page_output_path, encoding, encode_stats, page_num)
+        paths.append(page_output_path)
+    doc.close()
+    stats = cache.stats() if cache else None
+    return paths, stats, encode_stats.records
 
 
-def process_pdf(input_path, page_range, output_path, dpi=300, split_pages=False, password=None):
-    doc = fitz.open(input_path)
-    if doc.is_encrypted:
-        if not doc.authenticate(password):
-            raise ValueError("密码不正确")
+def _iter_render_chunks(input_path, pages, dpi, base_name, ext, workers, password=None, cache=None, doc_hash=None,
+                        encoding=DEFAULT_PRESET, encode_stats=None, chunk_pages=None):
+    """把页面按连续区间切成小块分发到进程池，按提交顺序逐块产出该块的输出路径列表。
+
+    同时在途的块数不超过进程数的两倍，调用方处理完一块后才提交下一块。
+    chunk_pages 为每块的页数，默认按总页数切成进程数四倍的块。
+    """
+    # 块数多于进程数，避免个别复杂页面拖慢整体
+    chunk_size = chunk_pages or max(1, -(-len(pages) // (workers * 4)))
+    chunks = []
+    chunk, pending = [], 0
+    for start, end in group_contiguous_pages(pages):
+        while start <= end:
+            take = min(end - start + 1, chunk_size - pending)
+            chunk.append((start, start + take - 1))
+            pending += take
+            start += take
+            if pending == chunk_size:
+                chunks.append(chunk)
+                chunk, pending = [], 0
+    if chunk:
+        chunks.append(chunk)
+    cache_config = (cache.cache_dir, cache.max_bytes, doc_hash) if cache and doc_hash else None
+
+    chunks = iter(chunks)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        running = collections.deque()
+
+        def submit_chunks():
+            for chunk in chunks:
+                running.append(executor.submit(_render_pages_worker, input_path, password, chunk, dpi, base_name,
+                                               ext, cache_config, encoding))
+                if len(running) >= workers * 2:
+                    break
+
+        submit_chunks()
+        while running:
+            chunk_paths, stats, encode_records = running.popleft().result()
+            submit_chunks()
+            if encode_stats is not None:
+                encode_stats.extend(encode_records)
+            if stats:
+                cache.hits += stats['hits']
+                cache.misses += stats['misses']
+                cache.evictions += stats['evictions']
+            yield chunk_paths
+
+
+def render_pages_parallel(input_path, pages, dpi, base_name, ext, workers, password=None, cache=None, doc_hash=None,
+                          encoding=DEFAULT_PRESET, encode_stats=None, progress=None):
+    """并行渲染并保存页面，按原页码顺序返回输出路径
+
+    pages 为有序页码列表或 parse_page_ranges 的结果，每块只传区间的首尾页码。
+    """
+    paths = []
+    for chunk_paths in _iter_render_chunks(input_path, pages, dpi, base_name, ext, workers, password, cache,
+                                           doc_hash, encoding, encode_stats):
+        paths.extend(chunk_paths)
+        if progress:
+            progress(len(paths), len(pages))
+    return paths
+
+
+class PngStreamWriter:
+    """逐页追加像素行的 PNG 写入器，内存中只保留当前页和 zlib 压缩状态"""
+
+    def __init__(self, path, width, height, compress_level=6):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.rows_written = 0
+        self.encode_seconds = 0.0
+        self._file = open(path, 'wb')
+        self._compressor = zlib.compressobj(compress_level)
+        self._file.write(b'\x89PNG\r\n\x1a\n')
+        # 8 位 RGB，无隔行扫描
+        self._write_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+
+    def _write_chunk(self, chunk_type, data):
+        self._file.write(struct.pack('>I', len(data)))
+        self._file.write(chunk_type)
+        self._file.write(data)
+        self._file.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type))))
+
+    def _write_rows(self, raw, rows):
+        start = time.perf_counter()
+        row_size = self.width * 3
+        # 每行前加过滤类型字节 0（不过滤）
+        scanlines = b''.join(b'\x00' + raw[y * row_size:(y + 1) * row_size] for y in range(rows))
+        compressed = self._compressor.compress(scanlines)
+        if compressed:
+            self._write_chunk(b'IDAT', compressed)
+        self.rows_written += rows
+        self.encode_seconds += time.perf_counter() - start
+
+    def write_image(self, img, height):
+        img = fit_page_image(img, self.width, height)
+        self._write_rows(img.tobytes(), height)
+
+    def close(self, encode_stats=None):
+        if self._file.closed:
+            return
+        if self.rows_written < self.height:
+            blank = Image.new('RGB', (self.width, self.height - self.rows_written), (255, 255, 255))
+            self._write_rows(blank.tobytes(), blank.height)
+        self._write_chunk(b'IDAT', self._compressor.flush())
+        self._write_chunk(b'IEND', b'')
+        self._file.close()
+        if encode_stats is not None:
+            encode_stats.add(None, self.path, self.encode_seconds, os.path.getsize(self.path), 'RGB')
+
+
+class CanvasImageWriter:
+    """JPEG 等格式无法增量编码，只为当前部分分配画布，页面逐页贴入后即可释放"""
+
+    def __init__(self, path, width, height, encoding=DEFAULT_PRESET):
+        self.path = path
+        self.encoding = encoding
+        self.canvas = Image.new('RGB', (width, height), (255, 255, 255))
+        self.y_offset = 0
+
+    def write_image(self, img, height):
+        self.canvas.paste(img, (0, self.y_offset))
+        self.y_offset += height
+
+    def close(self, encode_stats=None):
+        if self.canvas is not None:
+            save_page_image(self.canvas, self.path, self.encoding, encode_stats)
+            self.canvas = None
+
+
+def open_long_image_writer(path, width, height, encoding=DEFAULT_PRESET):
+    """PNG 长图流式写入，只采用预设的压缩级别；其他格式整张编码，按预设完整处理"""
+    if path.lower().endswith('.png'):
+        return PngStreamWriter(path, width, height, get_preset(encoding)['png_compress_level'])
+    return CanvasImageWriter(path, width, height, encoding)
+
+
+def fit_page_image(img, width, height):
+    """把页面图像对齐到长图宽度和预定高度，不足部分用白色补齐"""
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    if img.size == (width, height):
+        return img
+    fitted = Image.new('RGB', (width, height), (255, 255, 255))
+    fitted.paste(img, (0, 0))
+    return fitted
+
+
+def plan_long_image_parts(heights, max_height=LONG_IMAGE_MAX_HEIGHT):
+    """按高度上限把页面分组，每组拼成长图的一个部分"""
+    parts = []
+    current_part = []
+    current_height = 0
+    for height in heights:
+        if current_part and current_height + height > max_height:
+            parts.append(current_part)
+            current_part = []
+            current_height = 0
+        current_part.append(height)
+        current_height += height
+    if current_part:
+        parts.append(current_part)
+    return parts
+
+
+def iter_page_images(doc, input_path, pages, dpi, mat, workers=1, password=None, cache=None, doc_hash=None,
+                     render_backend=None, profiler=None):
+    """按页码顺序逐页产出 (页码, PIL 图像)，指定 render_backend 时由该后端渲染"""
+    if render_backend is not None:
+        backend_pages = render_backend.iter_pages(input_path, pages, dpi, password)
+        while True:
+            with stage(profiler, 'render'):
+                item = next(backend_pages, None)
+            if item is None:
+                return
+            yield item
+    elif workers > 1:
+        # 子进程把原始像素写成 PPM，主进程每收到一块就按顺序逐页读回并删除，
+        # 临时文件最多只有在途的几块，不会在拼接前堆满整个文档
+        spool_dir = tempfile.mkdtemp()
+        try:
+            chunks = _iter_render_chunks(input_path, pages, dpi, os.path.join(spool_dir, "page"), ".ppm", workers,
+                                         password, cache, doc_hash, chunk_pages=SPOOL_CHUNK_PAGES)
+            page_nums = iter(pages)
+            while True:
+                with stage(profiler, 'render'):
+                    chunk_paths = next(chunks, None)
+                if chunk_paths is None:
+                    break
+                # chunk_paths 放在前面，块内页面用完时不会多取走下一块的页码
+                for path, page_num in zip(chunk_paths, page_nums):
+                    with stage(profiler, 'convert'):
+                        with Image.open(path) as img:
+                            img.load()
+                        os.remove(path)
+                    yield page_num, img
+        finally:
+            shutil.rmtree(spool_dir, ignore_errors=True)
+    else:
+        for page_num in pages:
+            with stage(profiler, 'render'):
+                pix = render_page(doc[page_num - 1], mat, dpi, cache, doc_hash)
+            with stage(profiler, 'convert'):
+                img = pixmap_to_image(pix)
+            yield page_num, img
+
+
+def inspect_pdf(source, password=None, thumbnail_pages=4, thumbnail_dpi=THUMBNAIL_DPI):
+    """读取 PDF 的基本信息，不渲染正文页面。
+
+    返回加密标记、页数、各页尺寸（点）、不重复的嵌入图片数量，以及前 thumbnail_pages 页的 PNG 缩略图。
+    需要密码但未提供（或密码错误）时只返回加密标记和页数，其余字段为 None。
+    """
+    doc = _open_document(source)
+    try:
+        info = {
+            'encrypted': bool(doc.needs_pass),
+            'page_count': len(doc),
+            'page_sizes': None,
+            'image_count': None,
+            'thumbnails': None,
+        }
+        if doc.needs_pass and not doc.authenticate(password or ""):
+            return info
+
+        info['page_sizes'] = [(round(page.rect.width, 1), round(page.rect.height, 1)) for page in doc]
+        info['image_count'] = len({img[0] for page in doc for img in page.get_images()})
+        zoom = thumbnail_dpi / 72
+        mat = fitz.Matrix(zoom, zoom)
+        info['thumbnails'] = [doc[i].get_pixmap(matrix=mat, alpha=False).tobytes("png")
+                              for i in range(min(thumbnail_pages, len(doc)))]
+        return info
+    finally:
+        doc.close()
+
+
+def render_thumbnails(input_path, output_dir, dpi=THUMBNAIL_DPI, password=None, workers=1, progress=None):
+    """把每页渲染为低 DPI 的 PNG 缩略图 output_dir/page_<页码>.png，返回页数。
+
+    先写入同级的临时目录，全部完成后再改名为 output_dir，其他进程看到 output_dir 时缩略图一定完整；
+    output_dir 已存在时直接返回。完成后写入 thumbnails.json 记录页数和 DPI。
+    """
+    if os.path.exists(os.path.join(output_dir, THUMBNAIL_INDEX_FILENAME)):
+        with open(os.path.join(output_dir, THUMBNAIL_INDEX_FILENAME), 'r', encoding='utf-8') as f:
+            return json.load(f)['pages']
+
+    parent_dir = os.path.dirname(os.path.abspath(output_dir))
+    os.makedirs(parent_dir, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(dir=parent_dir, prefix=".thumbnails-")
+    try:
+        doc = open_pdf(input_path, password)
+        pages = parse_page_ranges("", len(doc))
+        base_name = os.path.join(tmp_dir, "page")
+        if workers > 1 and len(pages) > 1:
+            doc.close()
+            render_pages_parallel(input_path, pages, dpi, base_name, ".png", workers, password, encoding='fast',
+                                  progress=progress)
+        else:
+            zoom = dpi / 72
+            mat = fitz.Matrix(zoom, zoom)
+            for page_num in pages:
+                pix = render_page(doc[page_num - 1], mat, dpi)
+                save_page_image(pixmap_to_image(pix), f"{base_name}_{page_num}.png", 'fast')
+                if progress:
+                    progress(page_num, len(pages))
+            doc.close()
+
+        with open(os.path.join(tmp_dir, THUMBNAIL_INDEX_FILENAME), 'w', encoding='utf-8') as f:
+            json.dump({'pages': len(pages), 'dpi': dpi}, f)
+        try:
+            os.rename(tmp_dir, output_dir)
+        except OSError:
+            # 其他进程已经生成了同一文档的缩略图
+            if not os.path.exists(os.path.join(output_dir, THUMBNAIL_INDEX_FILENAME)):
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return len(pages)
+
+
+def iter_rendered_pages(source, pages=None, dpi=300, fmt='png', password=None, encoding=DEFAULT_PRESET, cache=None,
+                        encode_stats=None):
+    """逐页渲染并编码到内存，按页码顺序产出 (页码, 编码后的字节串)，不读写任何文件。
+
+    source 可以是 PDF 内容（bytes）、可读的文件对象、文件路径或已打开的文档；
+    pages 为页面范围字符串（如 '1,3-5'，留空为全部页面）或页码列表；fmt 为 'png' 或 'jpg'。
+    生成器每次只持有一页的像素和编码结果，调用方取走后即可释放。
+    """
+    fmt = fmt.lower()
+    if fmt not in ['jpg', 'jpeg', 'png']:
+        raise ValueError(f"不支持的输出格式: {fmt}")
+
+    owns_doc = not isinstance(source, fitz.Document)
+    doc = open_pdf(source, password)
+    try:
+        if pages is None or isinstance(pages, str):
+            pages = parse_page_ranges(pages or "", len(doc))
+        # 只有基于文件且未加密的文档才能按文件内容哈希使用页面缓存
+        doc_hash = PageCache.hash_file(doc.name) if cache and doc.name and not is_encrypted_pdf(doc) else None
+
+        zoom = dpi / 72
+        mat = fitz.Matrix(zoom, zoom)
+        for page_num in pages:
+            if not 1 <= page_num <= len(doc):
+                raise ValueError(f"页码 {page_num} 超出范围 (1-{len(doc)})")
+            pix = render_page(doc[page_num - 1], mat, dpi, cache, doc_hash)
+            yield page_num, encode_page_image(pixmap_to_image(pix), fmt, encoding, encode_stats, page_num)
+    finally:
+        if owns_doc:
+            doc.close()
+
+
+def process_pdf(input_path, page_range, output_path, dpi=300, split_pages=False, password=None, workers=1,
+                cache=None, backend='pymupdf', encoding=DEFAULT_PRESET, encode_stats=None, progress=None,
+                profiler=None):
+    """input_path 可以是文件路径或 open_pdf 返回的已认证文档。
+
+    子进程和其他渲染后端按路径重新打开文件：传入已认证的加密文档时，未同时提供 password 则只在当前进程中串行渲染。
+
+    backend 指定图片输出的渲染后端（见 pdf_backends），'auto' 按文档类型自动选择。
+    encoding 为图片输出的编码预设（见 pdf_encoding），提供 encode_stats 时记录每张图片的编码耗时和字节数。
+    progress(已完成页数, 总页数) 在每页完成后调用，回调中抛出异常即可中止处理。
+    提供 profiler（见 pdf_profile）时记录打开、渲染、转换、编码、拼接、保存等阶段的耗时和峰值内存。
+    """
+    owns_doc = not isinstance(input_path, fitz.Document)
+    doc = open_pdf(input_path, password, profiler)
+    # 多进程渲染和页面缓存需要通过文件路径访问原文件
+    input_path = doc.name
+    is_encrypted = is_encrypted_pdf(doc)
 
     total_pages = len(doc)
     pages_to_process = parse_page_ranges(page_range, total_pages)
@@ -56,127 +592,291 @@ def process_pdf(input_path, page_range, output_path, dpi=300, split_pages=False,
     _, file_extension = os.path.splitext(output_path)
     output_format = file_extension[1:].lower()
 
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    # 已认证的加密文档没有提供密码时，按路径重新打开的进程无法解密。
+    # 不能用 doc.needs_pass 判断：认证后读取它会使 PyMuPDF 之后解密内容流出错
+    reopen_needs_password = is_encrypted and password is None
+    parallel = workers > 1 and len(pages_to_process) > 1 and bool(input_path) and not reopen_needs_password
+
+    def report(done):
+        if progress:
+            progress(done, len(pages_to_process))
+
     if output_format in ['jpg', 'jpeg', 'png']:
         zoom = dpi / 72  # 默认 DPI 为 72
         mat = fitz.Matrix(zoom, zoom)
+        with stage(profiler, 'hash'):
+            doc_hash = PageCache.hash_file(input_path) if cache and input_path and not is_encrypted else None
+
+        render_backend = None
+        if backend == 'auto':
+            with stage(profiler, 'classify'):
+                backend, doc_type = select_backend(doc)
+            print(f"文档类型: {doc_type}，使用渲染后端: {backend}")
+        if backend != 'pymupdf':
+            if not input_path:
+                raise ValueError(f"渲染后端 {backend} 需要通过文件路径读取PDF")
+            if reopen_needs_password:
+                raise ValueError(f"渲染后端 {backend} 需要重新打开加密的PDF，请同时提供密码")
+            render_backend = get_backend(backend)
+            # 多进程渲染和页面缓存只适用于 PyMuPDF
+            parallel = False
 
         if split_pages:
             base_name, ext = os.path.splitext(output_path)
-            for page_num in pages_to_process:
-                page = doc[page_num - 1]
-                pix = page.get_pixmap(matrix=mat, alpha=False)
-                img = Image.open(io.BytesIO(pix.tobytes()))
-                page_output_path = f"{base_name}_{page_num}{ext}"
-                img.save(page_output_path)
-                print(f"输出文件已保存到: {page_output_path}")
+            if parallel:
+                # 子进程中渲染和编码一起完成，只能整体计时
+                with stage(profiler, 'render'):
+                    page_output_paths = render_pages_parallel(input_path, pages_to_process, dpi, base_name, ext,
+                                                              workers, password, cache, doc_hash, encoding,
+                                                              encode_stats)
+                for done, page_output_path in enumerate(page_output_paths, 1):
+                    print(f"输出文件已保存到: {page_output_path}")
+                    report(done)
+            else:
+                for done, (page_num, img) in enumerate(
+                        iter_page_images(doc, input_path, pages_to_process, dpi, mat, 1, password, cache, doc_hash,
+                                         render_backend, profiler), 1):
+                    page_output_path = f"{base_name}_{page_num}{ext}"
+                    with stage(profiler, 'encode'):
+                        save_page_image(img, page_output_path, encoding, encode_stats, page_num)
+                    print(f"输出文件已保存到: {page_output_path}")
+                    report(done)
         else:
-            images = []
-            for page_num in pages_to_process:
-                page = doc[page_num - 1]
-                pix = page.get_pixmap(matrix=mat, alpha=False)
-                img = Image.open(io.BytesIO(pix.tobytes()))
-                images.append(img)
-
-            if len(images) == 1:
-                images[0].save(output_path)
+            # 按页面几何尺寸预先规划长图，渲染结果逐页写入，不在内存中保留全部页面
+            with stage(profiler, 'layout'):
+                page_sizes = [(doc[page_num - 1].rect * mat).irect for page_num in pages_to_process]
+            page_images = iter_page_images(doc, input_path, pages_to_process, dpi, mat, workers if parallel else 1,
+                                           password, cache, doc_hash, render_backend, profiler)
+
+            if len(pages_to_process) == 1:
+                page_num, img = next(page_images)
+                with stage(profiler, 'encode'):
+                    save_page_image(img, output_path, encoding, encode_stats, page_num)
+                print(f"输出文件已保存到: {output_path}")
+                report(1)
             else:
-                # 计算总高度和最大宽度
-                total_height = sum(img.height for img in images)
-                max_width = max(img.width for img in images)
-
-                # 如果总高度超过限制，分割图像
-                max_height = 65000  # PIL的最大支持高度
-                if total_height > max_height:
-                    parts = []
-                    current_height = 0
-                    current_part = []
-                    for img in images:
-                        if current_height + img.height > max_height:
-                            parts.append(current_part)
-                            current_part = [img]
-                            current_height = img.height
-                        else:
-                            current_part.append(img)
-                            current_height += img.height
-                    if current_part:
-                        parts.append(current_part)
-
-                    # 保存每个部分
-                    base_name, ext = os.path.splitext(output_path)
-                    for i, part in enumerate(parts):
-                        part_height = sum(img.height for img in part)
-                        combined_img = Image.new('RGB', (max_width, part_height), (255, 255, 255))
-                        y_offset = 0
-                        for img in part:
-                            combined_img.paste(img, (0, y_offset))
-                            y_offset += img.height
-                        part_output_path = f"{base_name}_part{i + 1}{ext}"
-                        combined_img.save(part_output_path)
+                max_width = max(size.width for size in page_sizes)
+                parts = plan_long_image_parts([size.height for size in page_sizes])
+
+                base_name, ext = os.path.splitext(output_path)
+                done = 0
+                for i, part in enumerate(parts):
+                    part_output_path = f"{base_name}_part{i + 1}{ext}" if len(parts) > 1 else output_path
+                    writer = open_long_image_writer(part_output_path, max_width, sum(part), encoding)
+                    try:
+                        for height in part:
+                            _, img = next(page_images)
+                            with stage(profiler, 'stitch'):
+                                writer.write_image(img, height)
+                            done += 1
+                            report(done)
+                    finally:
+                        with stage(profiler, 'save'):
+                            writer.close(encode_stats)
+                    if len(parts) > 1:
                         print(f"输出文件（部分 {i + 1}）已保存到: {part_output_path}")
-                else:
-                    # 如果总高度没有超过限制，按原方式处理
-                    combined_img = Image.new('RGB', (max_width, total_height), (255, 255, 255))
-                    y_offset = 0
-                    for img in images:
-                        combined_img.paste(img, (0, y_offset))
-                        y_offset += img.height
-                    combined_img.save(output_path)
-                    print(f"输出文件已保存到: {output_path}")
+                    else:
+                        print(f"输出文件已保存到: {output_path}")
 
     elif output_format == 'pdf':
         new_doc = fitz.open()
-        for page_num in pages_to_process:
-            new_doc.insert_pdf(doc, from_page=page_num - 1, to_page=page_num - 1)
-        new_doc.save(output_path)
+        done = 0
+        # 连续页面整段插入
+        for start, end in group_contiguous_pages(pages_to_process):
+            with stage(profiler, 'copy'):
+                new_doc.insert_pdf(doc, from_page=start - 1, to_page=end - 1)
+            done += end - start + 1
+            report(done)
+        # 只清理未引用对象并压缩数据流，完整的优化见 optimize 命令
+        with stage(profiler, 'save'):
+            new_doc.save(output_path, garbage=1, deflate=True)
         print(f"输出文件已保存到: {output_path}")
     else:
         raise ValueError(f"不支持的输出格式: {output_format}")
 
-    doc.close()
+    if owns_doc:
+        doc.close()
+
+def expand_merge_inputs(patterns, list_file=None):
+    """展开合并输入：支持通配符，以及每行一个路径的列表文件"""
+    input_pdfs = []
+    if list_file:
+        with open(list_file, 'r', encoding='utf-8') as f:
+            input_pdfs.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    for pattern in patterns:
+        if glob.has_magic(pattern):
+            input_pdfs.extend(sorted(glob.glob(pattern)))
+        else:
+            input_pdfs.append(pattern)
+    return input_pdfs
+
+
+def merge_pdfs(input_pdfs, output_path, chunk_size=MERGE_CHUNK_SIZE, optimize=False, progress=None, profiler=None):
+    """分块合并 PDF。
+
+    第一块写入新文件，之后每块重新打开输出文件追加页面并增量保存，
+    内存中只保留当前块的对象。optimize=True 时最后整体重写一次，
+    合并各输入之间重复的字体、图片等对象并压缩数据流（需要加载整个文档，耗时较长）。
+    progress(已合并文件数, 总文件数) 在每个文件追加后调用。
+    提供 profiler（见 pdf_profile）时记录打开、追加、保存、优化各阶段的耗时和峰值内存。
+    """
+    input_pdfs = list(input_pdfs)
+    if not input_pdfs:
+        raise ValueError("没有要合并的PDF文件")
+
+    for chunk_start in range(0, len(input_pdfs), chunk_size):
+        chunk = input_pdfs[chunk_start:chunk_start + chunk_size]
+        with stage(profiler, 'open'):
+            merged_doc = fitz.open(output_path) if chunk_start else fitz.open()
+        for i, pdf_path in enumerate(chunk, chunk_start + 1):
+            with stage(profiler, 'open'):
+                doc = fitz.open(pdf_path)
+            with doc, stage(profiler, 'insert'):
+                merged_doc.insert_pdf(doc)
+            if progress:
+                progress(i, len(input_pdfs))
+        with stage(profiler, 'save'):
+            if chunk_start:
+                merged_doc.saveIncr()
+            else:
+                # garbage=3 合并重复对象的开销随对象数快速增长，这里只清理未引用对象
+                merged_doc.save(output_path, garbage=1)
+            merged_doc.close()
+        if len(input_pdfs) > chunk_size:
+            print(f"已合并 {min(chunk_start + chunk_size, len(input_pdfs))}/{len(input_pdfs)} 个文件")
+
+    if optimize:
+        tmp_path = f"{output_path}.tmp"
+        with stage(profiler, 'optimize'), fitz.open(output_path) as merged_doc:
+            merged_doc.save(tmp_path, garbage=3, deflate=True)
+        os.replace(tmp_path, output_path)
 
-def merge_pdfs(input_pdfs, output_path):
-    merged_doc = fitz.open()
-    for pdf_path in input_pdfs:
-        with fitz.open(pdf_path) as doc:
-            merged_doc.insert_pdf(doc)
-    merged_doc.save(output_path)
     print(f"合并的PDF文件已保存到: {output_path}")
 
 
-def extract_images_from_pdf(pdf_path, page_range_str, output_directory):
-    doc = fitz.open(pdf_path)
+def _converted_image_format(base_image):
+    """返回需要经 PIL 转换后保存的格式，可直接写入原始字节时返回 None"""
+    if base_image["ext"] == "jpx":
+        # JPEG 2000 大多数看图软件无法打开，转为 PNG
+        return "png"
+    if base_image.get("colorspace") == 4 and base_image["ext"] in ("jpeg", "jpg"):
+        # CMYK JPEG 在很多软件中颜色反转，转为 RGB
+        return "jpeg"
+    return None
+
+
+def _write_extracted_image(image_bytes, image_path, convert_format=None, reencode=False):
+    if convert_format or reencode:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            if convert_format and image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(image_path, format=convert_format)
+    else:
+        with open(image_path, 'wb') as f:
+            f.write(image_bytes)
+    return image_path
+
+
+def extract_images_from_pdf(pdf_path, page_range_str, output_directory, password=None, *, seen_hashes=None,
+                            reencode=False, progress=None, profiler=None):
+    """提取页面中的图片，每个图片对象只解码保存一次。
+
+    多个页面引用同一个 xref 时只记录引用；传入 seen_hashes（内容 SHA-256 -> 已保存路径）
+    可在多个文档之间按内容去重。页面与图片文件的对应关系写入 images_index.json。
+    图片默认按 PDF 中的原始字节直接写入，只有 JPX、CMYK 等格式才经 PIL 转换；
+    reencode=True 时所有图片都经 PIL 解码后重新保存。pdf_path 也可以是已认证的文档。
+    progress(已处理页数, 总页数) 在每页的图片提交写入后调用。
+    提供 profiler（见 pdf_profile）时记录各阶段的耗时和峰值内存；图片在线程池中写入，write 阶段为等待写完的时间。
+    """
+    doc = open_pdf(pdf_path, password, profiler)
     total_pages = len(doc)
     pages_to_process = parse_page_ranges(page_range_str, total_pages)
 
     if not os.path.exists(output_directory):
         os.makedirs(output_directory)
 
-    for page_num in pages_to_process:
-        page = doc[page_num - 1]
-        image_list = page.get_images()
+    extracted = {}  # xref -> 已保存的图片路径
+    index = {}
+    running = set()
+
+    def finish_writes(return_when):
+        nonlocal running
+        with stage(profiler, 'write'):
+            done, running = wait(running, return_when=return_when)
+        for future in done:
+            print(f"已保存图片: {future.result()}")
+
+    with ThreadPoolExecutor(max_workers=IMAGE_WRITE_WORKERS) as executor:
+        for done, page_num in enumerate(pages_to_process, 1):
+            with stage(profiler, 'scan'):
+                image_list = doc[page_num - 1].get_images()
+            page_images = index.setdefault(str(page_num), [])
 
-        for img_index, img in enumerate(image_list):
-            xref = img[0]
-            base_image = doc.extract_image(xref)
-            image_bytes = base_image["image"]
+            for img_index, img in enumerate(image_list):
+                xref = img[0]
+                if xref in extracted:
+                    page_images.append(os.path.relpath(extracted[xref], output_directory))
+                    continue
 
-            # 获取图片格式
-            image_format = base_image["ext"]
+                with stage(profiler, 'extract'):
+                    base_image = doc.extract_image(xref)
+                image_bytes = base_image["image"]
 
-            # 使用 PIL 打开图片
-            image = Image.open(io.BytesIO(image_bytes))
+                if seen_hashes is not None:
+                    with stage(profiler, 'hash'):
+                        digest = hashlib.sha256(image_bytes).hexdigest()
+                    if digest in seen_hashes and os.path.exists(seen_hashes[digest]):
+                        extracted[xref] = seen_hashes[digest]
+                        page_images.append(os.path.relpath(extracted[xref], output_directory))
+                        continue
 
-            # 保存图片
-            image_filename = f"page_{page_num}_image_{img_index + 1}.{image_format}"
-            image_path = os.path.join(output_directory, image_filename)
-            image.save(image_path)
-            print(f"已保存图片: {image_path}")
+                # 获取图片格式，需要转换的格式使用转换后的扩展名
+                convert_format = _converted_image_format(base_image)
+                image_format = convert_format or base_image["ext"]
 
-    print(f"所有图片已提取到目录: {output_directory}")
+                # 写文件放到线程池中进行
+                image_filename = f"page_{page_num}_image_{img_index + 1}.{image_format}"
+                image_path = os.path.join(output_directory, image_filename)
+                running.add(executor.submit(_write_extracted_image, image_bytes, image_path, convert_format,
+                                            reencode))
+                # 等待写入的图片数保持在线程数的两倍以内，限制驻留在内存中的图片数据
+                if len(running) >= IMAGE_WRITE_WORKERS * 2:
+                    finish_writes(FIRST_COMPLETED)
 
+                extracted[xref] = image_path
+                if seen_hashes is not None:
+                    seen_hashes[digest] = os.path.abspath(image_path)
+                page_images.append(image_filename)
 
-def encrypt_pdf(input_path, output_path, user_password, owner_password=None):
-    doc = fitz.open(input_path)
+            if progress:
+                progress(done, len(pages_to_process))
+
+        finish_writes(ALL_COMPLETED)
+
+    with stage(profiler, 'index'), open(os.path.join(output_directory, IMAGE_INDEX_FILENAME), 'w',
+                                         encoding='utf-8') as f:
+        json.dump(index, f, indent=2, ensure_ascii=False)
+
+    print(f"所有图片已提取到目录: {output_directory}（共 {len(set(extracted.values()))} 个不重复图片）")
+
+
+def load_image_hashes(hash_index_path):
+    if hash_index_path and os.path.exists(hash_index_path):
+        with open(hash_index_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+def save_image_hashes(hash_index_path, seen_hashes):
+    with open(hash_index_path, 'w', encoding='utf-8') as f:
+        json.dump(seen_hashes, f, indent=2, ensure_ascii=False)
+
+
+def encrypt_pdf(input_path, output_path, user_password, owner_password=None, profiler=None):
+    with stage(profiler, 'open'):
+        doc = fitz.open(input_path)
 
     if owner_password is None:
         owner_password = user_password
@@ -189,30 +889,262 @@ def encrypt_pdf(input_path, output_path, user_password, owner_password=None):
         | fitz.PDF_PERM_ANNOTATE
     )
 
-    doc.save(
-        output_path,
-        encryption=encryption_method,
-        user_pw=user_password,
-        owner_pw=owner_password,
-        permissions=permissions
-    )
+    with stage(profiler, 'save'):
+        doc.save(
+            output_path,
+            encryption=encryption_method,
+            user_pw=user_password,
+            owner_pw=owner_password,
+            permissions=permissions
+        )
     print(f"已加密的PDF保存到: {output_path}")
 
 
-def decrypt_pdf(input_path, output_path, password):
-    doc = fitz.open(input_path)
+def decrypt_pdf(input_path, output_path, password, profiler=None):
+    with stage(profiler, 'open'):
+        doc = fitz.open(input_path)
 
     if doc.is_encrypted:
-        if doc.authenticate(password):
-            doc.save(output_path)
+        with stage(profiler, 'authenticate'):
+            authenticated = doc.authenticate(password)
+        if authenticated:
+            with stage(profiler, 'save'):
+                doc.save(output_path)
             print(f"已解密的PDF保存到: {output_path}")
         else:
             raise ValueError("密码不正确")
     else:
         print("PDF文件未加密")
-        doc.save(output_path)
+        with stage(profiler, 'save'):
+            doc.save(output_path)
         print(f"PDF文件已复制到: {output_path}")
 
+def collect_batch_inputs(source, pattern="*.pdf", recursive=False):
+    """收集批处理的输入文件：source 为目录时按通配符查找，否则视为每行一个路径的列表文件"""
+    if os.path.isdir(source):
+        search = os.path.join(source, "**", pattern) if recursive else os.path.join(source, pattern)
+        return sorted(glob.glob(search, recursive=recursive))
+    with open(source, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith('#')]
+
+
+def load_batch_manifest(manifest_path):
+    """读取清单中已成功完成的任务，返回 {(任务类型, 输入路径, 输出路径)} 集合"""
+    completed = set()
+    if not manifest_path or not os.path.exists(manifest_path):
+        return completed
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 上次运行中断时最后一行可能不完整
+                continue
+            if record.get('status') == 'ok':
+                completed.add((record['job'], record['input'], record['output']))
+    return completed
+
+
+def batch_output_path(input_path, input_root, output_dir, job, output_format):
+    if input_root:
+        relative = os.path.relpath(input_path, input_root)
+    else:
+        relative = os.path.basename(input_path)
+    stem = os.path.splitext(relative)[0]
+    if job == 'process':
+        return os.path.join(output_dir, f"{stem}.{output_format}")
+    if job == 'extract':
+        return os.path.join(output_dir, stem)
+    return os.path.join(output_dir, f"{stem}.pdf")
+
+
+def _execute_job(record, func, *args, **kwargs):
+    """执行单个任务并在记录中补充状态、输入大小和耗时，任务自身的输出不打印"""
+    start = time.perf_counter()
+    try:
+        os.makedirs(os.path.dirname(record['output']) or '.', exist_ok=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            func(*args, **kwargs)
+        record['status'] = 'ok'
+    except Exception as e:
+        record['status'] = 'error'
+        record['error'] = str(e)
+    record['bytes'] = os.path.getsize(record['input']) if os.path.exists(record['input']) else 0
+    record['seconds'] = round(time.perf_counter() - start, 3)
+    return record
+
+
+def _run_batch_job(job, input_path, output_path, options):
+    """在子进程中执行单个批处理任务，返回写入清单的记录"""
+    record = {'job': job, 'input': input_path, 'output': output_path}
+    if job == 'process':
+        return _execute_job(record, process_pdf, input_path, options['page_range'], output_path, options['dpi'],
+                            options['split_pages'], options['password'], encoding=options['encoding'])
+    if job == 'extract':
+        return _execute_job(record, extract_images_from_pdf, input_path, options['page_range'], output_path,
+                            options['password'])
+    return _execute_job(record, encrypt_pdf, input_path, output_path, options['user_password'],
+                        options['owner_password'])
+
+
+def _run_crypt_job(mode, input_path, output_path, user_password, owner_password):
+    """在子进程中加密或解密单个文件，返回的记录中不包含密码"""
+    record = {'job': mode, 'input': input_path, 'output': output_path}
+    if mode == 'encrypt':
+        return _execute_job(record, encrypt_pdf, input_path, output_path, user_password, owner_password)
+    return _execute_job(record, decrypt_pdf, input_path, output_path, user_password)
+
+
+def _failed_job_record(task_args, error):
+    """任务在子进程外失败（如子进程崩溃）时补写的清单记录，任务参数的前三项为 (任务, 输入, 输出)"""
+    job, input_path, output_path = task_args[:3]
+    if isinstance(error, BrokenProcessPool):
+        message = f"子进程异常退出（可能是文件损坏导致崩溃）: {error}"
+    else:
+        message = str(error) or type(error).__name__
+    return {'job': job, 'input': input_path, 'output': output_path, 'status': 'error', 'error': message,
+            'bytes': os.path.getsize(input_path) if os.path.exists(input_path) else 0, 'seconds': 0.0}
+
+
+def run_job_pool(func, tasks, workers, manifest_path):
+    """用有界进程池执行任务，每完成一个就把记录追加到清单文件并打印进度，返回全部记录。
+
+    子进程崩溃（如 MuPDF 遇到损坏的文件）会使整个进程池失效：此时在运行的任务逐个在单独的进程中重试，
+    只有自身导致崩溃的任务记为失败，然后换一个新的进程池继续执行其余任务。
+    """
+    records = []
+    total = len(tasks)
+    tasks = iter(tasks)
+    executor = ProcessPoolExecutor(max_workers=workers)
+    running = {}
+
+    def record_result(task_args, future):
+        try:
+            record = future.result()
+        except Exception as e:
+            record = _failed_job_record(task_args, e)
+        manifest.write(json.dumps(record, ensure_ascii=False) + "\n")
+        manifest.flush()
+        records.append(record)
+        if record['status'] == 'ok':
+            print(f"[{len(records)}/{total}] 完成: {record['input']} -> {record['output']} "
+                  f"({record['seconds']:.2f} 秒)")
+        else:
+            print(f"[{len(records)}/{total}] 失败: {record['input']}: {record['error']}")
+
+    try:
+        with open(manifest_path, 'a', encoding='utf-8') as manifest:
+            while True:
+                pool_broken = False
+                # 同时提交的任务数保持在进程数的两倍以内
+                for task_args in tasks:
+                    try:
+                        future = executor.submit(func, *task_args)
+                    except BrokenProcessPool:
+                        # 进程池已失效但还没有任务报告失败，放回队列等换池后再提交
+                        tasks = itertools.chain([task_args], tasks)
+                        pool_broken = True
+                        break
+                    running[future] = task_args
+                    if len(running) >= workers * 2:
+                        break
+                if not running and not pool_broken:
+                    break
+                crashed = []
+                if running:
+                    done, _ = wait(running, return_when=FIRST_COMPLETED)
+                    if pool_broken or any(isinstance(future.exception(), BrokenProcessPool) for future in done):
+                        # 失效的进程池中其余在途任务也会随之失败
+                        done = wait(running).done
+                        pool_broken = True
+                    for future in done:
+                        task_args = running.pop(future)
+                        if isinstance(future.exception(), BrokenProcessPool):
+                            crashed.append(task_args)
+                        else:
+                            record_result(task_args, future)
+                if not pool_broken:
+                    continue
+                executor.shutdown()
+                for task_args in crashed:
+                    with ProcessPoolExecutor(max_workers=1) as isolated:
+                        record_result(task_args, isolated.submit(func, *task_args))
+                executor = ProcessPoolExecutor(max_workers=workers)
+    finally:
+        executor.shutdown()
+    return records
+
+
+def latency_percentiles(seconds, percentiles=(50, 90, 95, 99)):
+    """按最近秩法计算耗时分位数"""
+    values = sorted(seconds)
+    if not values:
+        return {}
+    return {p: values[max(0, math.ceil(p / 100 * len(values)) - 1)] for p in percentiles}
+
+
+def print_job_summary(records, elapsed, title):
+    ok_records = [record for record in records if record['status'] == 'ok']
+    print(f"\n{title}完成: 成功 {len(ok_records)} 个, 失败 {len(records) - len(ok_records)} 个, 耗时 {elapsed:.2f} 秒")
+    if elapsed > 0 and ok_records:
+        total_bytes = sum(record['bytes'] for record in ok_records)
+        print(f"吞吐量: {len(ok_records) / elapsed:.2f} 文件/秒, {total_bytes / 1024 ** 2 / elapsed:.2f} MB/秒")
+        percentiles = latency_percentiles([record['seconds'] for record in ok_records])
+        print("单文件耗时: " + ", ".join(f"p{p} {value * 1000:.0f} 毫秒" for p, value in percentiles.items())
+              + f", 最大 {max(record['seconds'] for record in ok_records) * 1000:.0f} 毫秒")
+
+
+def run_batch(inputs, output_dir, job, options, workers=None, manifest_path=None, input_root=None):
+    """用有界进程池批量执行任务，完成一个就追加一条清单记录，重新运行时跳过已成功的文件"""
+    workers = workers or os.cpu_count() or 1
+    manifest_path = manifest_path or os.path.join(output_dir, "batch_manifest.jsonl")
+    os.makedirs(output_dir, exist_ok=True)
+
+    completed = load_batch_manifest(manifest_path)
+    tasks = []
+    for input_path in inputs:
+        output_path = batch_output_path(input_path, input_root, output_dir, job, options['format'])
+        if (job, input_path, output_path) not in completed:
+            tasks.append((job, input_path, output_path, options))
+    print(f"共 {len(inputs)} 个文件，已完成 {len(inputs) - len(tasks)} 个，待处理 {len(tasks)} 个")
+
+    start = time.perf_counter()
+    records = run_job_pool(_run_batch_job, tasks, workers, manifest_path)
+    print_job_summary(records, time.perf_counter() - start, "批处理")
+    print(f"清单文件: {manifest_path}")
+
+
+def load_crypt_jobs(csv_path):
+    """读取批量加密/解密任务表，列为 input, output, user_pw, owner_pw（解密时 user_pw 为文件密码）"""
+    jobs = []
+    with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+        for line_num, row in enumerate(csv.DictReader(f), start=2):
+            input_path = (row.get('input') or '').strip()
+            output_path = (row.get('output') or '').strip()
+            if not input_path or not output_path:
+                raise ValueError(f"任务表第 {line_num} 行缺少 input 或 output")
+            jobs.append((input_path, output_path, row.get('user_pw') or '', row.get('owner_pw') or None))
+    return jobs
+
+
+def run_bulk_crypt(csv_path, mode, workers=None, status_path=None):
+    """按任务表并行加密或解密，结果逐条写入状态文件，重新运行时跳过已成功的行"""
+    workers = workers or os.cpu_count() or 1
+    status_path = status_path or f"{os.path.splitext(csv_path)[0]}_{mode}_status.jsonl"
+
+    jobs = load_crypt_jobs(csv_path)
+    completed = load_batch_manifest(status_path)
+    tasks = [(mode, input_path, output_path, user_password, owner_password)
+             for input_path, output_path, user_password, owner_password in jobs
+             if (mode, input_path, output_path) not in completed]
+    print(f"共 {len(jobs)} 个任务，已完成 {len(jobs) - len(tasks)} 个，待处理 {len(tasks)} 个")
+
+    start = time.perf_counter()
+    records = run_job_pool(_run_crypt_job, tasks, workers, status_path)
+    print_job_summary(records, time.perf_counter() - start, "批量加密" if mode == 'encrypt' else "批量解密")
+    print(f"状态文件: {status_path}")
+
+
 def main():
     parser = argparse.ArgumentParser(description="处理PDF文件：选择页面并输出为JPG、PNG或PDF，或合并多个PDF，或提取图片")
     subparsers = parser.add_subparsers(dest='command', help='可用的命令')
@@ -225,11 +1157,29 @@ def main():
     process_parser.add_argument("-d", "--dpi", type=int, default=300, help="图像DPI (仅用于jpg和png输出，默认: 300)")
     process_parser.add_argument("-p", "--password", help="PDF密码（如果PDF加密）")
     process_parser.add_argument("-s", "--split-pages", action='store_true', help="按每页生成单独的JPG或PNG文件")
+    process_parser.add_argument("-w", "--workers", type=int, default=1,
+                                help="并行渲染的进程数 (仅用于jpg和png输出，默认: 1 即串行，0 表示使用全部CPU核心)")
+    process_parser.add_argument("-b", "--backend", default='pymupdf', choices=['auto', *BACKENDS],
+                                help="图片输出的渲染后端 (默认: pymupdf；auto 按文档类型自动选择；poppler 不支持多进程和缓存)")
+    process_parser.add_argument("-e", "--encoding", default=DEFAULT_PRESET, choices=list(ENCODING_PRESETS),
+                                help=f"图片编码预设：fast 最快，balanced 兼顾，smallest 最小 (默认: {DEFAULT_PRESET})")
+    process_parser.add_argument("--encode-log", help="以JSON Lines格式追加每张图片的编码耗时和字节数的文件")
+    process_parser.add_argument("--cache-dir", default=os.environ.get("PDF_TOOL_CACHE_DIR"),
+                                help="页面位图缓存目录 (默认读取环境变量 PDF_TOOL_CACHE_DIR，不设置则不缓存)")
+    process_parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE // 1024 ** 2,
+                                help="页面位图缓存上限，单位MB (默认: 2048)")
 
     # 合并PDF的命令
     merge_parser = subparsers.add_parser('merge', help='合并多个PDF文件')
-    merge_parser.add_argument("input_pdfs", nargs='+', help="要合并的PDF文件路径列表")
+    merge_parser.add_argument("input_pdfs", nargs='*', help="要合并的PDF文件路径列表，支持通配符，例如 'reports/*.pdf'")
     merge_parser.add_argument("output", help="输出的合并PDF文件路径")
+    merge_parser.add_argument("-l", "--list-file", help="每行一个PDF路径的列表文件，其中的文件排在命令行输入之前")
+    merge_parser.add_argument("-c", "--chunk-size", type=int, default=MERGE_CHUNK_SIZE,
+                              help=f"每次增量保存前追加的文件数 (默认: {MERGE_CHUNK_SIZE})")
+    merge_parser.add_argument("--optimize", action='store_true',
+                              help="合并完成后整体重写一次，去除各文件间重复的字体和图片（需要更多内存）")
+    merge_parser.add_argument("-b", "--backend", default='pymupdf', choices=list(BACKENDS),
+                              help="合并使用的后端 (默认: pymupdf；poppler 后端使用 PyPDF2，不支持分块和去重选项)")
 
     # 提取图片的命令
     extract_parser = subparsers.add_parser('extract', help='从PDF中提取图片')
@@ -237,6 +1187,10 @@ def main():
     extract_parser.add_argument("page_range", help="要提取图片的页面范围，例如 '1,3-5,7-9'")
     extract_parser.add_argument("output_directory", help="保存提取图片的目录路径")
     extract_parser.add_argument("-p", "--password", help="PDF密码（如果PDF加密）")
+    extract_parser.add_argument("--reencode", action='store_true',
+                                help="所有图片都经 PIL 解码后重新保存（默认直接写入PDF中的原始图片数据）")
+    extract_parser.add_argument("--hash-index",
+                                help="跨文档去重使用的图片哈希索引文件（JSON），已在其他文档中提取过的相同图片只记录引用")
 
     # 加密PDF的命令
     encrypt_parser = subparsers.add_parser('encrypt', help='加密PDF文件')
@@ -251,59 +1205,204 @@ def main():
     decrypt_parser.add_argument("output_pdf", help="输出解密PDF文件的路径")
     decrypt_parser.add_argument("password", help="PDF密码")
 
+    for profiled_parser in (process_parser, merge_parser, extract_parser, encrypt_parser, decrypt_parser):
+        profiled_parser.add_argument("--profile", action='store_true', help="完成后打印各阶段的耗时和峰值内存")
+        profiled_parser.add_argument("--profile-log", help="以JSON Lines格式追加各阶段耗时和峰值内存的文件")
+
+    # 批量处理的命令
+    batch_parser = subparsers.add_parser('batch', help='批量处理目录或列表文件中的PDF')
+    batch_parser.add_argument("job", choices=['process', 'extract', 'encrypt'], help="对每个文件执行的操作")
+    batch_parser.add_argument("input", help="输入目录，或每行一个PDF路径的列表文件")
+    batch_parser.add_argument("output_directory", help="输出目录")
+    batch_parser.add_argument("-r", "--page-range", default="", help="页面范围，留空处理所有页面 (process/extract)")
+    batch_parser.add_argument("-f", "--format", default="pdf", choices=['pdf', 'png', 'jpg', 'jpeg'],
+                              help="输出格式 (process，默认: pdf)")
+    batch_parser.add_argument("-d", "--dpi", type=int, default=300, help="图像DPI (process，默认: 300)")
+    batch_parser.add_argument("-s", "--split-pages", action='store_true', help="按每页生成单独的JPG或PNG文件 (process)")
+    batch_parser.add_argument("-e", "--encoding", default=DEFAULT_PRESET, choices=list(ENCODING_PRESETS),
+                              help=f"图片编码预设 (process，默认: {DEFAULT_PRESET})")
+    batch_parser.add_argument("-p", "--password", help="输入PDF的密码 (process/extract)")
+    batch_parser.add_argument("-u", "--user-password", help="用户密码 (encrypt)")
+    batch_parser.add_argument("-o", "--owner-password", help="所有者密码 (encrypt，不提供则与用户密码相同)")
+    batch_parser.add_argument("-w", "--workers", type=int, default=0, help="并行进程数 (默认: 0 即CPU核心数)")
+    batch_parser.add_argument("-m", "--manifest", help="清单文件路径 (默认: 输出目录/batch_manifest.jsonl)")
+    batch_parser.add_argument("--pattern", default="*.pdf", help="输入为目录时匹配的文件名 (默认: *.pdf)")
+    batch_parser.add_argument("--recursive", action='store_true', help="输入为目录时递归查找子目录")
+
+    # 按任务表批量加密/解密的命令
+    bulk_parser = subparsers.add_parser('bulk', help='按CSV任务表并行批量加密或解密PDF')
+    bulk_parser.add_argument("mode", choices=['encrypt', 'decrypt'], help="批量加密或解密")
+    bulk_parser.add_argument("jobs_csv", help="任务表CSV，列为 input,output,user_pw,owner_pw（解密时 user_pw 为文件密码）")
+    bulk_parser.add_argument("-w", "--workers", type=int, default=0, help="并行进程数 (默认: 0 即CPU核心数)")
+    bulk_parser.add_argument("--status", help="状态文件路径 (默认: 任务表同名_<mode>_status.jsonl)")
+
+    # 压缩优化的命令
+    optimize_parser = subparsers.add_parser('optimize', help='降采样图片并重写PDF以减小文件大小')
+    optimize_parser.add_argument("input", help="输入PDF文件、目录，或每行一个PDF路径的列表文件")
+    optimize_parser.add_argument("output", help="输出PDF文件路径，输入为目录或列表文件时为输出目录")
+    optimize_parser.add_argument("-d", "--dpi", type=int, default=150, help="图片降采样的目标DPI (默认: 150)")
+    optimize_parser.add_argument("-e", "--encoding", default=DEFAULT_PRESET, choices=list(ENCODING_PRESETS),
+                                 help=f"降采样后图片的编码预设 (默认: {DEFAULT_PRESET})")
+    optimize_parser.add_argument("-p", "--password", help="输入PDF的密码")
+    optimize_parser.add_argument("-w", "--workers", type=int, default=0, help="处理图片的进程数 (默认: 0 即CPU核心数)")
+    optimize_parser.add_argument("--pattern", default="*.pdf", help="输入为目录时匹配的文件名 (默认: *.pdf)")
+    optimize_parser.add_argument("--recursive", action='store_true', help="输入为目录时递归查找子目录")
+
+    # 全文索引和搜索的命令
+    text_parser = subparsers.add_parser('text', help='提取目录或列表文件中PDF的文本，建立全文索引')
+    text_parser.add_argument("input", help="输入目录，或每行一个PDF路径的列表文件")
+    text_parser.add_argument("-i", "--index", help="索引文件路径 (默认: 输入目录/pdf_text_index.db)")
+    text_parser.add_argument("-p", "--password", help="输入PDF的密码")
+    text_parser.add_argument("-w", "--workers", type=int, default=0, help="并行进程数 (默认: 0 即CPU核心数)")
+    text_parser.add_argument("--pattern", default="*.pdf", help="输入为目录时匹配的文件名 (默认: *.pdf)")
+    text_parser.add_argument("--recursive", action='store_true', help="输入为目录时递归查找子目录")
+    text_parser.add_argument("--rebuild", action='store_true', help="清空索引后重新提取所有文件")
+
+    search_parser = subparsers.add_parser('search', help='在全文索引中搜索，列出命中的文档和页码')
+    search_parser.add_argument("index", help="索引文件路径，或建立索引时的输入目录")
+    search_parser.add_argument("query", help="搜索内容，多个关键词用空格分隔，需全部包含")
+    search_parser.add_argument("-n", "--limit", type=int, default=50, help="最多返回的页数 (默认: 50)")
+
     args = parser.parse_args()
+    profiler = None
+    if getattr(args, 'profile', False) or getattr(args, 'profile_log', None):
+        target = args.output if args.command == 'merge' else args.input_pdf
+        profiler = StageProfiler(args.command, target)
 
     if args.command == 'process':
+        cache = PageCache(args.cache_dir, args.cache_size * 1024 ** 2) if args.cache_dir else None
+        encode_stats = EncodeStats(args.encoding)
         try:
-            decrypted_pdf_path = try_remove_pdf_password(args.input_pdf, args.password)
-            process_pdf(decrypted_pdf_path, args.page_range, args.output, args.dpi, args.split_pages)
-            if decrypted_pdf_path != args.input_pdf:
-                os.remove(decrypted_pdf_path)
+            process_pdf(args.input_pdf, args.page_range, args.output, args.dpi, args.split_pages, args.password,
+                        workers=args.workers, cache=cache, backend=args.backend, encoding=args.encoding,
+                        encode_stats=encode_stats, profiler=profiler)
         except ValueError as e:
             if "PDF文件已加密，需要密码" in str(e):
                 password = input("请输入PDF密码: ")
                 try:
-                    decrypted_pdf_path = try_remove_pdf_password(args.input_pdf, password)
-                    process_pdf(decrypted_pdf_path, args.page_range, args.output, args.dpi, args.split_pages)
+                    process_pdf(args.input_pdf, args.page_range, args.output, args.dpi, args.split_pages, password,
+                                workers=args.workers, cache=cache, backend=args.backend, encoding=args.encoding,
+                                encode_stats=encode_stats, profiler=profiler)
                 except ValueError as e:
                     print(f"处理过程中出错: {str(e)}")
             else:
                 print(f"处理过程中出错: {str(e)}")
         except Exception as e:
             print(f"处理过程中出错: {str(e)}")
+        if cache:
+            stats = cache.stats()
+            print(f"页面缓存: 命中 {stats['hits']} 次, 未命中 {stats['misses']} 次, 淘汰 {stats['evictions']} 个")
+        if encode_stats.records:
+            summary = encode_stats.summary()
+            print(f"图片编码 ({summary['preset']}): {summary['images']} 张, 平均 {summary['ms_per_image']:.1f} 毫秒/张, "
+                  f"平均 {summary['bytes_per_image'] / 1024:.1f} KB/张")
+            if args.encode_log:
+                encode_stats.write_log(args.encode_log)
     elif args.command == 'merge':
         try:
-            merge_pdfs(args.input_pdfs, args.output)
+            input_pdfs = expand_merge_inputs(args.input_pdfs, args.list_file)
+            if args.backend == 'pymupdf':
+                merge_pdfs(input_pdfs, args.output, args.chunk_size, args.optimize, profiler=profiler)
+            else:
+                get_backend(args.backend).merge(input_pdfs, args.output)
         except Exception as e:
             print(f"合并PDF过程中出错: {str(e)}")
     elif args.command == 'extract':
+        seen_hashes = load_image_hashes(args.hash_index) if args.hash_index else None
         try:
-            decrypted_pdf_path = try_remove_pdf_password(args.input_pdf, args.password)
-            extract_images_from_pdf(decrypted_pdf_path, args.page_range, args.output_directory)
-            if decrypted_pdf_path != args.input_pdf:
-                os.remove(decrypted_pdf_path)
+            extract_images_from_pdf(args.input_pdf, args.page_range, args.output_directory, args.password,
+                                    seen_hashes=seen_hashes, reencode=args.reencode, profiler=profiler)
         except ValueError as e:
             if "PDF文件已加密，需要密码" in str(e):
                 password = input("请输入PDF密码: ")
                 try:
-                    decrypted_pdf_path = try_remove_pdf_password(args.input_pdf, password)
-                    extract_images_from_pdf(decrypted_pdf_path, args.page_range, args.output_directory)
+                    extract_images_from_pdf(args.input_pdf, args.page_range, args.output_directory, password,
+                                            seen_hashes=seen_hashes, reencode=args.reencode, profiler=profiler)
                 except ValueError as e:
                     print(f"处理过程中出错: {str(e)}")
             else:
                 print(f"处理过程中出错: {str(e)}")
         except Exception as e:
             print(f"处理过程中出错: {str(e)}")
+        if seen_hashes is not None:
+            save_image_hashes(args.hash_index, seen_hashes)
     elif args.command == 'encrypt':
         try:
-            encrypt_pdf(args.input_pdf, args.output_pdf, args.user_password, args.owner_password)
+            encrypt_pdf(args.input_pdf, args.output_pdf, args.user_password, args.owner_password, profiler)
         except Exception as e:
             print(f"加密PDF过程中出错: {str(e)}")
     elif args.command == 'decrypt':
         try:
-            decrypt_pdf(args.input_pdf, args.output_pdf, args.password)
+            decrypt_pdf(args.input_pdf, args.output_pdf, args.password, profiler)
         except Exception as e:
             print(f"解密PDF过程中出错: {str(e)}")
+    elif args.command == 'batch':
+        if args.job == 'encrypt' and not args.user_password:
+            parser.error("encrypt 任务需要提供 --user-password")
+        try:
+            inputs = collect_batch_inputs(args.input, args.pattern, args.recursive)
+            options = {
+                'page_range': args.page_range,
+                'format': args.format,
+                'dpi': args.dpi,
+                'split_pages': args.split_pages,
+                'encoding': args.encoding,
+                'password': args.password,
+                'user_password': args.user_password,
+                'owner_password': args.owner_password,
+            }
+            input_root = args.input if os.path.isdir(args.input) else None
+            run_batch(inputs, args.output_directory, args.job, options, args.workers, args.manifest, input_root)
+        except Exception as e:
+            print(f"批处理过程中出错: {str(e)}")
+    elif args.command == 'bulk':
+        try:
+            run_bulk_crypt(args.jobs_csv, args.mode, args.workers, args.status)
+        except Exception as e:
+            print(f"批量{'加密' if args.mode == 'encrypt' else '解密'}过程中出错: {str(e)}")
+    elif args.command == 'optimize':
+        from pdf_optimize import optimize_pdfs
+        try:
+            if os.path.isfile(args.input) and args.input.lower().endswith('.pdf'):
+                tasks = [(args.input, args.output)]
+            else:
+                input_root = args.input if os.path.isdir(args.input) else None
+                tasks = [(input_path, batch_output_path(input_path, input_root, args.output, 'optimize', 'pdf'))
+                         for input_path in collect_batch_inputs(args.input, args.pattern, args.recursive)]
+            optimize_pdfs(tasks, args.dpi, args.password, args.encoding, args.workers)
+        except Exception as e:
+            print(f"优化PDF过程中出错: {str(e)}")
+    elif args.command == 'text':
+        from pdf_search import TEXT_INDEX_FILENAME, build_text_index
+        try:
+            inputs = collect_batch_inputs(args.input, args.pattern, args.recursive)
+            index_path = args.index or os.path.join(args.input if os.path.isdir(args.input)
+                                                    else os.path.dirname(os.path.abspath(args.input)),
+                                                    TEXT_INDEX_FILENAME)
+            build_text_index(inputs, index_path, args.password, args.workers, args.rebuild)
+        except Exception as e:
+            print(f"建立索引过程中出错: {str(e)}")
+    elif args.command == 'search':
+        from pdf_search import TEXT_INDEX_FILENAME, hits_to_page_ranges, search_index
+        index_path = os.path.join(args.index, TEXT_INDEX_FILENAME) if os.path.isdir(args.index) else args.index
+        try:
+            start = time.perf_counter()
+            hits = search_index(index_path, args.query, args.limit)
+            elapsed = time.perf_counter() - start
+        except Exception as e:
+            print(f"搜索过程中出错: {str(e)}")
+            return
+        for hit in hits:
+            print(f"{hit['path']} 第 {hit['page']} 页: {hit['snippet']}")
+        print(f"共 {len(hits)} 个结果，耗时 {elapsed * 1000:.1f} 毫秒")
+        for path, page_range in hits_to_page_ranges(hits).items():
+            print(f"python pdf_tool.py process \"{path}\" {page_range} output.pdf")
+
+    if profiler is not None:
+        if args.profile:
+            profiler.print_table()
+        if args.profile_log:
+            profiler.write_log(args.profile_log)
 
 if __name__ == "__main__":
     main()
@@ -1,5 +1,6 @@
 import os
 import requests
+from requests.adapters import HTTPAdapter
 import markdownify
 from bs4 import BeautifulSoup
 import re
@@ -9,10 +10,19 @@ import time
 import json
 import csv
 import argparse
-import random  # 新增random模块
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass, field
 from typing import List, Optional, Dict
 from pathlib import Path
+from urllib.parse import urlparse
+
+DEFAULT_WORKERS = 4  # 同时处理的文章数
+# 每个主机每秒允许的文章页面请求数，0.3 即约 3.3 秒一次，与原先每篇之间至少等待 3 秒相当
+DEFAULT_RATE = 0.3
+IMAGE_WORKERS = 8  # 每篇文章同时下载的图片数
+IMAGE_TIMEOUT = (10, 30)  # 图片请求的连接和读取超时，单位秒
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
 
 @dataclass
 class ContentFilterConfig:
@@ -22,6 +32,34 @@ class ContentFilterConfig:
     skip_ads: bool = False
     skip_promotions: bool = False
 
+class HostRateLimiter:
+    """按主机的令牌桶限速器：每个主机每秒补充 rate 个令牌，最多积攒 burst 个，每次请求消耗一个"""
+
+    def __init__(self, rate: float = DEFAULT_RATE, burst: int = 1):
+        if rate <= 0:
+            raise ValueError("请求速率必须大于0")
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.wait_seconds = 0.0  # 所有线程因限速累计等待的时间
+        self._buckets: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, url: str) -> None:
+        """阻塞直到该URL所在主机有可用令牌"""
+        host = urlparse(url).netloc
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                tokens, updated = self._buckets.get(host, (self.burst, now))
+                tokens = min(self.burst, tokens + (now - updated) * self.rate)
+                if tokens >= 1:
+                    self._buckets[host] = (tokens - 1, now)
+                    return
+                self._buckets[host] = (tokens, now)
+                delay = (1 - tokens) / self.rate
+                self.wait_seconds += delay
+            time.sleep(delay)
+
 class WeChatArticleDownloader:
     CONFIG_FILE = "wechat_downloader_config.json"
     
@@ -34,9 +72,23 @@ class WeChatArticleDownloader:
         return ''.join(c for c in text if (unicodedata.category(c) != 'Cn' 
                                         and c not in (' ', '\n', '\r')))
 
-    def __init__(self, config_path: Optional[str] = None):
+    def __init__(self, config_path: Optional[str] = None, image_workers: int = IMAGE_WORKERS):
         self.config_path = config_path or self.CONFIG_FILE
         self.filter_config = self._load_config()
+        self.rate_limiter: Optional[HostRateLimiter] = None
+        self.image_workers = max(1, image_workers)
+        self.session = self._create_session(self.image_workers)
+
+    @staticmethod
+    def _create_session(pool_size: int) -> requests.Session:
+        """创建所有请求共用的会话，连接池保持长连接，避免每张图片重新建立TCP/TLS连接"""
+        session = requests.Session()
+        # pool_size 为每个主机保留的连接数，应不少于同时进行的请求数，否则多出的连接用完即被丢弃
+        adapter = HTTPAdapter(pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        session.headers['User-Agent'] = USER_AGENT
+        return session
 
     def _load_config(self) -> ContentFilterConfig:
         default_config = ContentFilterConfig()
@@ -113,12 +165,34 @@ class WeChatArticleDownloader:
         paragraph_text = ' '.join(paragraph)
         return any(keyword in paragraph_text for keyword in keywords)
 
+    def _save_image(self, img_link: str, file_ext: str, image_folder: str) -> Optional[str]:
+        """下载一张图片，以内容哈希为文件名保存，返回文件名；图片在过滤列表中时返回None"""
+        response = self.session.get(img_link, timeout=IMAGE_TIMEOUT)
+        response.raise_for_status()
+        file_content = response.content
+
+        img_hash = self.hash_byte_data(file_content)
+        if img_hash in self.filter_config.image_hashes:
+            return None
+
+        filename = f"{img_hash}.{file_ext}"
+        filepath = os.path.join(image_folder, filename)
+        if not os.path.exists(filepath):
+            # 同一公众号的多篇文章可能同时保存同一张图片，先写临时文件再改名
+            tmp_path = f"{filepath}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(file_content)
+            os.replace(tmp_path, filepath)
+        return filename
+
     def download_images(self, soup: BeautifulSoup, account_dir: str) -> None:
-        """下载文章中的所有图片并保存到本地"""
+        """并行下载文章中的所有图片并保存到本地"""
         # 创建images目录（与markdown文件同级）
         image_folder = os.path.join(account_dir, 'images')
         os.makedirs(image_folder, exist_ok=True)
 
+        # 同一图片链接在文章中出现多次时只下载一次
+        images: Dict[tuple, List] = {}
         for img in soup.find_all('img'):
             img_link = img.get('data-src') or img.get('src')
             if not img_link:
@@ -129,29 +203,30 @@ class WeChatArticleDownloader:
             if not img_link.startswith(('http://', 'https://')):
                 img_link = 'https://mp.weixin.qq.com' + img_link
 
-            try:
-                with requests.get(img_link, stream=True) as response:
-                    response.raise_for_status()
-                    file_content = response.content
-                    
-                    img_hash = self.hash_byte_data(file_content)
-                    if img_hash in self.filter_config.image_hashes:
-                        continue
+            file_ext = (img.get('data-type') or 'jpg').split('?')[0]
+            images.setdefault((img_link, file_ext), []).append(img)
 
-                    file_ext = (img.get('data-type') or 'jpg').split('?')[0]
-                    filename = f"{img_hash}.{file_ext}"
-                    filepath = os.path.join(image_folder, filename)
-                    
-                    if not os.path.exists(filepath):
-                        with open(filepath, 'wb') as f:
-                            f.write(file_content)
-
-                    # 更新图片属性指向本地文件（使用相对路径 ./images/）
-                    relative_path = f"./images/{filename}"
-                    img['data-src'] = relative_path
-                    img['src'] = relative_path
+        if not images:
+            return
+        with ThreadPoolExecutor(max_workers=min(self.image_workers, len(images))) as executor:
+            futures = {executor.submit(self._save_image, img_link, file_ext, image_folder): (img_link, tags)
+                       for (img_link, file_ext), tags in images.items()}
+
+        # 全部下载完成后再在当前线程中修改标签，BeautifulSoup 对象不能在多个线程中同时修改
+        for future, (img_link, tags) in futures.items():
+            try:
+                filename = future.result()
             except requests.exceptions.RequestException as e:
                 print(f"图片下载失败，URL: {img_link}, 错误: {e}")
+                continue
+            if filename is None:
+                continue
+
+            # 更新图片属性指向本地文件（使用相对路径 ./images/）
+            relative_path = f"./images/{filename}"
+            for img in tags:
+                img['data-src'] = relative_path
+                img['src'] = relative_path
 
     def convert_to_markdown(self, url: str, title: str, create_time: str, 
                           content_soup: BeautifulSoup, account_dir: str) -> tuple:
@@ -182,12 +257,10 @@ class WeChatArticleDownloader:
         retries = 0
         while retries < max_retries:
             try:
-                # 设置请求头模拟浏览器访问
-                headers = {
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-                }
-                
-                response = requests.get(url, headers=headers, timeout=10)
+                # 会话的请求头中已设置浏览器的 User-Agent
+                if self.rate_limiter:
+                    self.rate_limiter.acquire(url)
+                response = self.session.get(url, timeout=10)
                 response.raise_for_status()
                 
                 soup = BeautifulSoup(response.text, 'lxml')
@@ -253,25 +326,48 @@ class WeChatArticleDownloader:
         print(f'Processed: {account_name} - {filename}.md')
         return True
 
-    def run(self, csv_path: str, output_dir: str = "./articles", url_column: str = "链接"):
-        """运行下载器"""
+    def run(self, csv_path: str, output_dir: str = "./articles", url_column: str = "链接",
+            workers: int = DEFAULT_WORKERS, rate: float = DEFAULT_RATE, burst: int = 1):
+        """运行下载器：多个线程同时处理文章，同一主机的页面请求按令牌桶限速，避免过于频繁请求"""
         urls_data = self.load_urls_from_csv(csv_path, url_column)
         if not urls_data:
             print("没有找到可处理的URL")
             return
 
         os.makedirs(output_dir, exist_ok=True)
-        
+        self.rate_limiter = HostRateLimiter(rate, burst)
+        # 每篇文章最多同时下载 image_workers 张图片，连接池按同时进行的请求总数配置
+        # 先关闭初始化时创建的会话，新会话在全部文章处理完后关闭
+        self.session.close()
+        self.session = self._create_session(max(1, workers) * self.image_workers)
+
         success_count = 0
-        for url_data in urls_data:
-            if self.process_url(url_data, output_dir):
-                success_count += 1
-            # 随机延迟3-8秒，避免过于频繁请求
-            delay = random.uniform(3, 8)
-            print(f"等待 {delay:.2f} 秒后继续...")
-            time.sleep(delay)
-        
-        print(f"\n处理完成: 共{len(urls_data)}条, 成功{success_count}条")
+        finished_count = 0
+        start = time.perf_counter()
+        with self.session:
+            executor = ThreadPoolExecutor(max_workers=max(1, workers))
+            futures = {executor.submit(self.process_url, url_data, output_dir): url_data
+                       for url_data in urls_data}
+            try:
+                for future in as_completed(futures):
+                    finished_count += 1
+                    try:
+                        if future.result():
+                            success_count += 1
+                    except Exception as e:
+                        print(f"处理失败，URL: {futures[future]['url']}, 错误: {e}")
+            except KeyboardInterrupt:
+                print("\n已中断，等待正在处理的文章完成...")
+            finally:
+                # 中断时取消尚未开始的文章
+                executor.shutdown(cancel_futures=True)
+
+        elapsed = time.perf_counter() - start
+        throughput = finished_count / elapsed * 60 if elapsed else 0.0
+        print(f"\n处理完成: 共{len(urls_data)}条, 已处理{finished_count}条, 成功{success_count}条, "
+              f"失败{finished_count - success_count}条")
+        print(f"耗时 {elapsed:.1f} 秒, 吞吐量 {throughput:.1f} 篇/分钟, "
+              f"限速累计等待 {self.rate_limiter.wait_seconds:.1f} 秒")
 
 def main():
     parser = argparse.ArgumentParser(description='微信公众号文章下载器')
@@ -281,17 +377,28 @@ def main():
     parser.add_argument('-c', '--column', default='链接', 
                        help='CSV中包含URL的列名 (默认: 链接)')
     parser.add_argument('--config', help='自定义配置文件路径')
+    parser.add_argument('-w', '--workers', type=int, default=DEFAULT_WORKERS,
+                       help=f'同时处理的文章数 (默认: {DEFAULT_WORKERS})')
+    parser.add_argument('-r', '--rate', type=float, default=DEFAULT_RATE,
+                       help=f'每个主机每秒最多请求的文章页面数 (默认: {DEFAULT_RATE})')
+    parser.add_argument('--burst', type=int, default=1,
+                       help='每个主机允许连续突发的请求数 (默认: 1)')
+    parser.add_argument('--image-workers', type=int, default=IMAGE_WORKERS,
+                       help=f'每篇文章同时下载的图片数 (默认: {IMAGE_WORKERS})')
     
     args = parser.parse_args()
     
     # 初始化下载器
-    downloader = WeChatArticleDownloader(args.config)
+    downloader = WeChatArticleDownloader(args.config, args.image_workers)
     
     # 运行下载任务
     downloader.run(
         csv_path=args.csv_file,
         output_dir=args.output,
-        url_column=args.column
+        url_column=args.column,
+        workers=args.workers,
+        rate=args.rate,
+        burst=args.burst
     )
 
 if __name__ == "__main__":